@@ -1,39 +1,87 @@
+import time
+STARTUP_BEGIN = time.perf_counter()
+
 import discord
 from discord.ext import commands
-import matplotlib.pyplot as plt
 from pypinyin import pinyin, Style
-import anthropic
+from pypinyin.constants import PINYIN_DICT
 import io
 import os
 import asyncio
 import threading
 import json
 from flask import Flask
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.font_manager as fm
 import re
+import math
 from google.cloud import firestore
 from google.oauth2 import service_account
-from gtts import gTTS
-from pydub import AudioSegment
-import tempfile
-from PIL import Image
-import io
-import time
+from google.api_core import exceptions as gcp_exceptions
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
 import aiohttp
+import sqlite3
+import hashlib
+import unicodedata
+from collections import OrderedDict, deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# matplotlib, gTTS and anthropic are imported on first use - see load_matplotlib(),
+# synthesize_audio() and init_anthropic_client()
+
+# Startup timing breakdown, printed once the bot is ready
+startup_timings = []
+
+def record_startup_phase(name, started):
+    """Record how long a startup phase took, measured from a perf_counter() value."""
+    elapsed = time.perf_counter() - started
+    startup_timings.append((name, elapsed))
+    print(f"⏱️ {name}: {elapsed:.2f}s")
+
+def log_startup_timings():
+    total = time.perf_counter() - STARTUP_BEGIN
+    breakdown = ', '.join(f"{name} {elapsed:.2f}s" for name, elapsed in startup_timings)
+    print(f"⏱️ Startup took {total:.2f}s ({breakdown})")
 
-# Set matplotlib cache directory to a writable location
-os.environ['MPLCONFIGDIR'] = '/tmp/matplotlib'
-# Create the directory if it doesn't exist
-os.makedirs('/tmp/matplotlib', exist_ok=True)
+record_startup_phase('imports', STARTUP_BEGIN)
 
-# Clear matplotlib font cache and rebuild
-fm._load_fontmanager(try_read_cache=False)
+# Matplotlib cache directory - the Docker image prebuilds the font cache here.
+# It must be set before matplotlib is first imported.
+os.environ.setdefault('MPLCONFIGDIR', '/tmp/matplotlib')
+os.makedirs(os.environ['MPLCONFIGDIR'], exist_ok=True)
 
-# Set font properties for CJK support
-plt.rcParams['font.family'] = ['Noto Sans CJK SC', 'Noto Sans CJK JP', 'DejaVu Sans', 'sans-serif']
-plt.rcParams['axes.unicode_minus'] = False
+# Local cache directory - /data is persistent storage on Hugging Face Spaces
+CACHE_DIR = os.getenv('CACHE_DIR', '/data/pinyin_cache' if os.path.isdir('/data') else '/tmp/pinyin_cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+matplotlib_module = None
+matplotlib_import_lock = threading.Lock()
+
+def load_matplotlib():
+    """Import and configure matplotlib on first use, reusing the prebuilt font cache."""
+    global matplotlib_module
+    
+    with matplotlib_import_lock:
+        if matplotlib_module is None:
+            started = time.perf_counter()
+            
+            import matplotlib
+            matplotlib.use('Agg')  # Use non-interactive backend
+            import matplotlib.font_manager as fm
+            
+            # Only rescan system fonts when asked to (e.g. fonts changed without rebuilding the image)
+            if os.getenv('REBUILD_FONT_CACHE', '').lower() in ('1', 'true', 'yes'):
+                fm._load_fontmanager(try_read_cache=False)
+            
+            # Set font properties for CJK support
+            matplotlib.rcParams['font.family'] = ['Noto Sans CJK SC', 'Noto Sans CJK JP', 'DejaVu Sans', 'sans-serif']
+            matplotlib.rcParams['axes.unicode_minus'] = False
+            
+            matplotlib_module = matplotlib
+            record_startup_phase('matplotlib', started)
+    
+    return matplotlib_module
 
 # Flask app for health check (required for Hugging Face Spaces)
 app = Flask(__name__)
@@ -42,6 +90,22 @@ app = Flask(__name__)
 def health_check():
     return "Discord bot is running!"
 
+# Prometheus metrics, served from /metrics
+STAGE_SECONDS = Histogram(
+    'pinyin_stage_seconds', 'Time spent in each processing stage', ['stage'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+CACHE_LOOKUPS = Counter('pinyin_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+ERRORS = Counter('pinyin_errors_total', 'Errors by stage', ['stage'])
+MESSAGES_PROCESSED = Counter('pinyin_messages_processed_total', 'Messages fully processed')
+LINES_PROCESSED = Counter('pinyin_lines_processed_total', 'Lines rendered and sent')
+QUEUE_DEPTH = Gauge('pinyin_queue_depth', 'Jobs waiting in the pinyin queue')
+ACTIVE_CHANNELS = Gauge('pinyin_active_channels', 'Channels with pinyin enabled')
+
+@app.route('/metrics')
+def metrics():
+    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
 # Firestore setup - NO FALLBACK, MUST WORK
 def init_firestore():
     """Initialize Firestore client - REQUIRED, no fallback."""
@@ -153,79 +217,350 @@ Bot cannot start without Firestore connection!
     print(error_msg)
     raise Exception("Firestore connection required but failed to initialize")
 
-# Initialize Firestore - REQUIRED
-print("🚀 Starting Firestore initialization...")
-db = init_firestore()
-print("🎉 Firestore successfully connected!")
+# Firestore client - connected by connect_firestore() when the bot starts, so importing
+# this module (benchmarks, load tests) needs no credentials
+db = None
+
+def connect_firestore():
+    """Initialize Firestore - REQUIRED before the bot starts."""
+    global db
+    
+    print("🚀 Starting Firestore initialization...")
+    firestore_started = time.perf_counter()
+    db = init_firestore()
+    record_startup_phase('firestore', firestore_started)
+    print("🎉 Firestore successfully connected!")
+
+class ChannelIndex:
+    """Active (guild_id, channel_id) pairs indexed by guild.
+    
+    Behaves like a set of channel keys, but a guild's channels can be found
+    or dropped without scanning every active channel.
+    """
+    
+    def __init__(self, channel_keys=()):
+        self.guilds = {}  # guild_id (None for DMs) -> set of channel_ids
+        self.count = 0
+        self.update(channel_keys)
+    
+    def __contains__(self, channel_key):
+        guild_id, channel_id = channel_key
+        return channel_id in self.guilds.get(guild_id, ())
+    
+    def __iter__(self):
+        for guild_id, channel_ids in list(self.guilds.items()):
+            for channel_id in list(channel_ids):
+                yield guild_id, channel_id
+    
+    def __len__(self):
+        return self.count
+    
+    def add(self, channel_key):
+        guild_id, channel_id = channel_key
+        channel_ids = self.guilds.setdefault(guild_id, set())
+        if channel_id not in channel_ids:
+            channel_ids.add(channel_id)
+            self.count += 1
+    
+    def discard(self, channel_key):
+        guild_id, channel_id = channel_key
+        channel_ids = self.guilds.get(guild_id)
+        if channel_ids and channel_id in channel_ids:
+            channel_ids.remove(channel_id)
+            self.count -= 1
+            if not channel_ids:
+                del self.guilds[guild_id]
+    
+    def update(self, channel_keys):
+        for channel_key in channel_keys:
+            self.add(channel_key)
+    
+    def difference_update(self, channel_keys):
+        for channel_key in channel_keys:
+            self.discard(channel_key)
+    
+    def replace(self, channel_keys):
+        self.guilds = {}
+        self.count = 0
+        self.update(channel_keys)
+    
+    def guild_channels(self, guild_id):
+        """Channel keys of one guild."""
+        return [(guild_id, channel_id) for channel_id in self.guilds.get(guild_id, ())]
 
 # Store active channels (guild_id, channel_id) pairs
-active_channels = set()
+active_channels = ChannelIndex()
+
+def parse_shard_ids(value):
+    """Parse SHARD_IDS like "0-3" or "0,2,5" into a sorted list, or None if unset."""
+    if not value.strip():
+        return None
+    shard_ids = set()
+    for part in value.split(','):
+        if '-' in part:
+            first, last = part.split('-', 1)
+            shard_ids.update(range(int(first), int(last) + 1))
+        else:
+            shard_ids.add(int(part))
+    return sorted(shard_ids)
+
+# SHARD_COUNT alone runs every shard in this process; adding SHARD_IDS makes
+# this process run (and own the channels of) only those shards
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = parse_shard_ids(os.getenv('SHARD_IDS', ''))
+SHARD_LABEL = f"shards_{SHARD_IDS[0]}-{SHARD_IDS[-1]}" if SHARD_IDS else None
+
+def shard_for_guild(guild_id):
+    """Shard that receives a guild's events. Discord sends DMs to shard 0."""
+    if guild_id is None:
+        return 0
+    return (guild_id >> 22) % (bot.shard_count or 1)
+
+def owns_channel(channel_key):
+    """True if this process runs the shard for the channel's guild."""
+    return SHARD_IDS is None or shard_for_guild(channel_key[0]) in SHARD_IDS
+
+# Legacy layout: one document holding every channel
 CHANNELS_COLLECTION = 'active_channels'
 CHANNELS_DOCUMENT = 'channels_data'
+# Current layout: one document per (guild_id, channel_id)
+CHANNEL_DOCS_COLLECTION = 'channel_entries'
+FIRESTORE_BATCH_LIMIT = 500
+
+# Firestore calls run in their own thread pool so network round trips never block the event loop
+FIRESTORE_TIMEOUT = float(os.getenv('FIRESTORE_TIMEOUT', '15'))
+FIRESTORE_RETRIES = int(os.getenv('FIRESTORE_RETRIES', '3'))
+FIRESTORE_RETRYABLE = (
+    asyncio.TimeoutError,
+    gcp_exceptions.ServiceUnavailable,
+    gcp_exceptions.DeadlineExceeded,
+    gcp_exceptions.InternalServerError,
+    gcp_exceptions.Aborted,
+)
+firestore_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='firestore')
+
+async def run_firestore(func, *args):
+    """Run a blocking Firestore call in the Firestore pool with a timeout and retries."""
+    loop = asyncio.get_running_loop()
+    delay = 0.5
+    
+    for attempt in range(FIRESTORE_RETRIES):
+        try:
+            with STAGE_SECONDS.labels('firestore').time():
+                return await asyncio.wait_for(
+                    loop.run_in_executor(firestore_executor, func, *args),
+                    timeout=FIRESTORE_TIMEOUT
+                )
+        except FIRESTORE_RETRYABLE as e:
+            if attempt == FIRESTORE_RETRIES - 1:
+                ERRORS.labels('firestore').inc()
+                raise
+            print(f"⚠️ Firestore call {getattr(func, '__name__', func)} failed (attempt {attempt + 1}/{FIRESTORE_RETRIES}): {e!r}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay *= 2
+
+async def commit_in_batches(operation, channel_keys):
+    """Apply operation(batch, doc_ref, channel_key) to each channel, committing every FIRESTORE_BATCH_LIMIT writes."""
+    channels_list = list(channel_keys)
+    for start in range(0, len(channels_list), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for channel_key in channels_list[start:start + FIRESTORE_BATCH_LIMIT]:
+            operation(batch, db.collection(CHANNEL_DOCS_COLLECTION).document(channel_doc_id(channel_key)), channel_key)
+        await run_firestore(batch.commit)
+
+def channel_doc_id(channel_key):
+    """Firestore document ID for a (guild_id, channel_id) pair."""
+    guild_id, channel_id = channel_key
+    return f"{guild_id if guild_id is not None else 'dm'}_{channel_id}"
+
+def channel_doc_data(channel_key):
+    return {
+        'guild_id': channel_key[0],
+        'channel_id': channel_key[1],
+        'added_at': firestore.SERVER_TIMESTAMP
+    }
 
 async def load_active_channels():
     """Load active channels from Firestore - REQUIRED."""
-    global active_channels
-
     print("📥 Loading active channels from Firestore...")
 
     try:
-        # Load from Firestore
-        doc_ref = db.collection(CHANNELS_COLLECTION).document(CHANNELS_DOCUMENT)
-        doc = doc_ref.get()
-
-        if doc.exists:
-            data = doc.to_dict()
-            channels_data = data.get('channels', [])
-
-            # Convert list of dicts back to set of tuples
-            active_channels = set(
-                (channel.get('guild_id'), channel.get('channel_id'))
-                for channel in channels_data
-                if channel is not None and 'guild_id' in channel and 'channel_id' in channel
-            )
+        # Copy channels over from the legacy single document if it hasn't been migrated yet.
+        # Done before reading so shard processes racing on the migration all see its writes.
+        await migrate_legacy_channels_document()
+        
+        # Load one document per channel
+        docs = await run_firestore(lambda: list(db.collection(CHANNEL_DOCS_COLLECTION).stream(timeout=FIRESTORE_TIMEOUT)))
+        channels = set(
+            (data.get('guild_id'), data.get('channel_id'))
+            for data in (doc.to_dict() for doc in docs)
+            if data is not None and 'guild_id' in data and 'channel_id' in data
+        )
+        
+        # Changes logged locally but not yet flushed win over what Firestore has
+        channel_journal.apply(channels)
+        
+        # Each shard process only serves (and writes) channels of guilds on its own shards
+        active_channels.replace(channel_key for channel_key in channels if owns_channel(channel_key))
 
+        if SHARD_IDS is None:
             print(f"✅ Loaded {len(active_channels)} active channels from Firestore")
         else:
-            active_channels = set()
-            print("📝 No existing channels document in Firestore, starting with empty channel list")
-            # Create initial empty document
-            doc_ref.set({
-                'channels': [],
-                'last_updated': firestore.SERVER_TIMESTAMP,
-                'total_channels': 0
-            })
-            print("✅ Created initial empty channels document in Firestore")
+            print(f"✅ Loaded {len(active_channels)} of {len(channels)} active channels from Firestore for shards {SHARD_IDS}")
 
     except Exception as e:
         print(f"❌ CRITICAL ERROR loading active channels from Firestore: {e}")
         raise Exception(f"Failed to load channels from Firestore: {e}")
 
 
-async def save_active_channels():
-    """Save active channels to Firestore - REQUIRED."""
+async def migrate_legacy_channels_document():
+    """Copy the legacy channels_data document into per-channel documents, once."""
+    doc_ref = db.collection(CHANNELS_COLLECTION).document(CHANNELS_DOCUMENT)
+    doc = await run_firestore(doc_ref.get)
+    
+    if not doc.exists:
+        return set()
+    
+    data = doc.to_dict()
+    if data.get('migrated'):
+        return set()
+    
+    legacy_channels = set(
+        (channel.get('guild_id'), channel.get('channel_id'))
+        for channel in data.get('channels', [])
+        if channel is not None and 'guild_id' in channel and 'channel_id' in channel
+    )
+    
+    print(f"🚚 Migrating {len(legacy_channels)} channels from legacy {CHANNELS_DOCUMENT} document...")
+    
+    await commit_in_batches(lambda batch, ref, channel_key: batch.set(ref, channel_doc_data(channel_key)), legacy_channels)
+    
+    # Keep the old document for reference but never migrate it again
+    await run_firestore(doc_ref.update, {'migrated': True, 'migrated_at': firestore.SERVER_TIMESTAMP})
+    print(f"✅ Migrated {len(legacy_channels)} channels to {CHANNEL_DOCS_COLLECTION}")
+    
+    return legacy_channels
+
 
-    print(f"💾 Saving {len(active_channels)} active channels to Firestore...")
+class ChannelJournal:
+    """Write-behind log of active_channels changes.
+    
+    Mutations are appended to a local file for durability and flushed to
+    Firestore in coalesced batches, so commands never wait on Firestore.
+    """
+    
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.pending = {}  # channel_key -> 'add' or 'remove', last write wins
+        self.flush_lock = None  # created on the bot's event loop
+        self.task = None
+        
+        # Pick up changes that were logged but not flushed before the last shutdown
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.pending[(entry['guild_id'], entry['channel_id'])] = entry['op']
+                    except (ValueError, KeyError):
+                        print(f"⚠️ Skipping corrupt journal line: {line!r}")
+            if self.pending:
+                print(f"📒 Found {len(self.pending)} unflushed channel changes in journal")
+    
+    def record(self, op, channel_keys):
+        """Append changes to the journal file and queue them for the next flush."""
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for guild_id, channel_id in channel_keys:
+                f.write(json.dumps({'op': op, 'guild_id': guild_id, 'channel_id': channel_id}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        
+        for channel_key in channel_keys:
+            self.pending[channel_key] = op
+    
+    def apply(self, channels):
+        """Replay pending changes onto a set of channels loaded from Firestore."""
+        for channel_key, op in self.pending.items():
+            if op == 'add':
+                channels.add(channel_key)
+            else:
+                channels.discard(channel_key)
+    
+    def rewrite(self):
+        """Rewrite the journal so it holds only changes that are still pending."""
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for (guild_id, channel_id), op in self.pending.items():
+                f.write(json.dumps({'op': op, 'guild_id': guild_id, 'channel_id': channel_id}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+    
+    async def flush(self):
+        """Write all pending changes to Firestore in batched commits."""
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            
+            snapshot = dict(self.pending)
+            print(f"💾 Flushing {len(snapshot)} channel changes to Firestore...")
+            
+            def operation(batch, ref, channel_key):
+                if snapshot[channel_key] == 'add':
+                    batch.set(ref, channel_doc_data(channel_key))
+                else:
+                    batch.delete(ref)
+            
+            try:
+                await commit_in_batches(operation, snapshot)
+            except Exception as e:
+                print(f"❌ Failed to flush channel changes to Firestore, will retry: {e}")
+                return
+            
+            # Drop what was flushed, unless it changed again while we were writing
+            for channel_key, op in snapshot.items():
+                if self.pending.get(channel_key) == op:
+                    del self.pending[channel_key]
+            self.rewrite()
+            print(f"✅ Flushed {len(snapshot)} channel changes to Firestore")
+    
+    async def run(self):
+        """Flush on a fixed interval until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+    
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        """Stop the flusher and write out anything still pending."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
 
-    try:
-        # Save to Firestore
-        doc_ref = db.collection(CHANNELS_COLLECTION).document(CHANNELS_DOCUMENT)
+channel_journal = ChannelJournal(
+    # Shard processes may share CACHE_DIR, so each keeps its own journal
+    os.path.join(CACHE_DIR, f'channel_journal_{SHARD_LABEL}.jsonl' if SHARD_LABEL else 'channel_journal.jsonl'),
+    interval=float(os.getenv('CHANNEL_FLUSH_INTERVAL', '2'))
+)
 
-        data = {
-            'channels': [
-                {'guild_id': channel[0], 'channel_id': channel[1]}
-                for channel in active_channels
-            ],
-            'last_updated': firestore.SERVER_TIMESTAMP,
-            'total_channels': len(active_channels)
-        }
+def add_active_channel(channel_key):
+    """Activate a channel in memory and log it for the next Firestore flush."""
+    channel_journal.record('add', [channel_key])
+    active_channels.add(channel_key)
 
-        doc_ref.set(data)
-        print(f"✅ Successfully saved {len(active_channels)} active channels to Firestore")
 
-    except Exception as e:
-        print(f"❌ CRITICAL ERROR saving active channels to Firestore: {e}")
-        raise Exception(f"Failed to save channels to Firestore: {e}")
+def remove_active_channels(channel_keys):
+    """Deactivate channels in memory and log them for the next Firestore flush."""
+    channel_journal.record('remove', list(channel_keys))
+    active_channels.difference_update(channel_keys)
 
 
 async def create_backup():
@@ -236,15 +571,19 @@ async def create_backup():
     try:
         # Create backup collection with timestamp
         backup_id = discord.utils.utcnow().strftime("%Y%m%d_%H%M%S")
+        if SHARD_LABEL:
+            # Each shard process backs up its own channels without overwriting the others
+            backup_id = f"{backup_id}_{SHARD_LABEL}"
         backup_ref = db.collection('channel_backups').document(backup_id)
         
         data = {
             'channels': [list(channel) for channel in active_channels],
             'backup_date': firestore.SERVER_TIMESTAMP,
-            'total_channels': len(active_channels)
+            'total_channels': len(active_channels),
+            'shard_ids': SHARD_IDS
         }
         
-        backup_ref.set(data)
+        await run_firestore(backup_ref.set, data)
         print(f"✅ Successfully created backup {backup_id} with {len(active_channels)} channels")
         return backup_id
         
@@ -252,96 +591,261 @@ async def create_backup():
         print(f"❌ CRITICAL ERROR creating Firestore backup: {e}")
         raise Exception(f"Failed to create Firestore backup: {e}")
 
-def is_chinese_char(char):
-    """Check if a character is Chinese."""
-    return '\u4e00' <= char <= '\u9fff'
+# CJK ideograph blocks treated as Chinese: Unified, Extensions A-G and Compatibility
+CJK_RANGES = [
+    ('\u3400', '\u4dbf'),          # Extension A
+    ('\u4e00', '\u9fff'),          # Unified Ideographs
+    ('\uf900', '\ufaff'),          # Compatibility Ideographs
+    ('\U00020000', '\U0002ebef'),  # Extensions B-F
+    ('\U0002f800', '\U0002fa1f'),  # Compatibility Ideographs Supplement
+    ('\U00030000', '\U0003134f'),  # Extension G
+]
+CJK_CLASS = ''.join(f'{start}-{end}' for start, end in CJK_RANGES)
+CHINESE_RE = re.compile(f'[{CJK_CLASS}]')
+# Splitting on a captured run alternates non-Chinese / Chinese pieces, starting with non-Chinese
+SEGMENT_SPLIT_RE = re.compile(f'([{CJK_CLASS}]+)')
 
 def has_chinese_content(text):
     """Check if text contains Chinese characters."""
-    return any(is_chinese_char(char) for char in text)
-
-def tokenize_text(text):
-    """Tokenize text into segments of Chinese characters and non-Chinese segments."""
-    segments = []
-    current_segment = ""
-    is_current_chinese = None
-    
-    for char in text:
-        char_is_chinese = is_chinese_char(char)
-        
-        if is_current_chinese is None:
-            # First character
-            current_segment = char
-            is_current_chinese = char_is_chinese
-        elif char_is_chinese == is_current_chinese:
-            # Same type as current segment
-            current_segment += char
-        else:
-            # Different type, start new segment
-            segments.append({
-                'text': current_segment,
-                'is_chinese': is_current_chinese
-            })
-            current_segment = char
-            is_current_chinese = char_is_chinese
-    
-    # Add the last segment
-    if current_segment:
-        segments.append({
-            'text': current_segment,
-            'is_chinese': is_current_chinese
-        })
-    
-    return segments
-
-def get_pinyin_for_segments(segments):
-    """Get pinyin for segments, only process Chinese segments."""
-    result_segments = []
-    
-    for segment in segments:
-        if segment['is_chinese']:
-            # Process Chinese characters
-            pinyin_list = []
-            for char in segment['text']:
-                py = pinyin(char, style=Style.TONE)
-                if py and py[0]:
-                    pinyin_list.append(py[0][0].replace("u:", "ü"))
-                else:
-                    pinyin_list.append(char)
-            
-            result_segments.append({
-                'original': segment['text'],
-                'pinyin': ' '.join(pinyin_list),
-                'is_chinese': True
-            })
-        else:
-            # Non-Chinese text, keep as is
-            result_segments.append({
-                'original': segment['text'],
-                'pinyin': segment['text'],
-                'is_chinese': False
-            })
+    return CHINESE_RE.search(text) is not None
+
+def tokenize_spans(text):
+    """Yield (start, end, is_chinese) spans of Chinese and non-Chinese runs in one pass."""
+    start = 0
+    is_chinese = False
     
-    return result_segments
+    for piece in SEGMENT_SPLIT_RE.split(text):
+        if piece:
+            yield start, start + len(piece), is_chinese
+            start += len(piece)
+        is_chinese = not is_chinese
 
-def translate_chinese_to_japanese(text):
-    try:
-        # Initialize Anthropic client
-        client = anthropic.Anthropic(
-            api_key=os.getenv('ANTHROPIC_API_KEY')
+def build_pinyin_table():
+    """Build a code point -> tone-marked pinyin table from pypinyin's character dictionary."""
+    # PINYIN_DICT stores comma-separated readings; the first is pypinyin's default reading
+    return {
+        code_point: readings.split(',', 1)[0].replace("u:", "ü")
+        for code_point, readings in PINYIN_DICT.items()
+    }
+
+# Precomputed once at startup so single characters never go through pypinyin
+PINYIN_TABLE = build_pinyin_table()
+PINYIN_CACHE_SIZE = int(os.getenv('PINYIN_CACHE_SIZE', '4096'))
+
+@lru_cache(maxsize=PINYIN_CACHE_SIZE)
+def segment_to_pinyin(text):
+    """Convert a Chinese-only segment to space-separated pinyin."""
+    if len(text) == 1:
+        return PINYIN_TABLE.get(ord(text), text)
+    
+    # Whole-segment conversion keeps pypinyin's phrase context (e.g. 银行 → yín háng)
+    syllables = [item[0].replace("u:", "ü") for item in pinyin(text, style=Style.TONE) if item]
+    if len(syllables) != len(text):
+        # pypinyin merged or dropped something - fall back to the character table
+        syllables = [PINYIN_TABLE.get(ord(char), char) for char in text]
+    
+    return ' '.join(syllables)
+
+def spans_to_pinyin(text, spans):
+    """Pinyin line for text from its tokenize_spans: Chinese runs converted, everything else kept as is."""
+    return ''.join(
+        segment_to_pinyin(text[start:end]) if is_chinese else text[start:end]
+        for start, end, is_chinese in spans
+    )
+
+def text_to_pinyin(text):
+    return spans_to_pinyin(text, tokenize_spans(text))
+
+class TranslationCache:
+    """Two-tier translation cache: in-memory LRU in front of a SQLite store.
+    
+    The memory tier is only touched from the event loop. SQLite work runs on a
+    single dedicated thread so queries and commits never block the loop.
+    """
+    
+    def __init__(self, path, memory_size=1024, disk_size=50000, ttl=30 * 24 * 3600):
+        self.memory = OrderedDict()
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.ttl = ttl
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.writes = 0
+        # key -> last access time, written to SQLite with the next put instead of on every read
+        self.touched = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='translation-cache')
+        
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS translations ('
+            'key TEXT PRIMARY KEY, translation TEXT NOT NULL, '
+            'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
         )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_accessed ON translations (accessed_at)')
+        self.conn.commit()
+    
+    def summary(self):
+        """Return a one-line description of the hit/miss counters."""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        rate = (hits / total * 100) if total else 0
+        return (f"{hits}/{total} hits ({rate:.0f}%) - memory {self.stats['memory_hits']}, "
+                f"disk {self.stats['disk_hits']}, evictions {self.stats['evictions']}")
+    
+    @staticmethod
+    def normalize(text):
+        """Normalize text so trivially different inputs share a cache entry."""
+        return ' '.join(unicodedata.normalize('NFKC', text).split())
+    
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    async def get_many(self, texts):
+        """Look up several texts. Memory misses are read from SQLite in one query off the loop."""
+        keys = [self.normalize(text) for text in texts]
+        now = time.time()
+        results = [self._get_memory(key, now) for key in keys]
+        
+        missing = list({key for key, result in zip(keys, results) if result is None})
+        rows = await self._run(self._read_disk, missing) if missing else {}
+        
+        for i, key in enumerate(keys):
+            if results[i] is not None:
+                continue
+            row = rows.get(key)
+            if row is not None and now - row[1] < self.ttl:
+                self._remember(key, row[0], row[1])
+                self.touched[key] = now
+                self.stats['disk_hits'] += 1
+                CACHE_LOOKUPS.labels('translation', 'disk_hit').inc()
+                results[i] = row[0]
+            else:
+                self.stats['misses'] += 1
+                CACHE_LOOKUPS.labels('translation', 'miss').inc()
+        
+        return results
+    
+    async def put_many(self, items):
+        """Store (text, translation) pairs, writing them and pending access times in one commit."""
+        now = time.time()
+        rows = []
+        for text, translation in items:
+            key = self.normalize(text)
+            self._remember(key, translation, now)
+            rows.append((key, translation, now, now))
+        
+        touched, self.touched = self.touched, {}
+        await self._run(self._write_disk, rows, touched, now)
+    
+    def _get_memory(self, key, now):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        translation, created_at = entry
+        if now - created_at >= self.ttl:
+            del self.memory[key]
+            return None
+        self.memory.move_to_end(key)
+        self.touched[key] = now
+        self.stats['memory_hits'] += 1
+        CACHE_LOOKUPS.labels('translation', 'memory_hit').inc()
+        return translation
+    
+    def _remember(self, key, translation, created_at):
+        self.memory[key] = (translation, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+            self.stats['evictions'] += 1
+    
+    def _read_disk(self, keys):
+        placeholders = ','.join('?' * len(keys))
+        return {
+            key: (translation, created_at)
+            for key, translation, created_at in self.conn.execute(
+                f'SELECT key, translation, created_at FROM translations WHERE key IN ({placeholders})', keys
+            )
+        }
+    
+    def _write_disk(self, rows, touched, now):
+        # Access times land before eviction runs, so the LRU order is current when rows are dropped
+        self.conn.executemany(
+            'UPDATE translations SET accessed_at = ? WHERE key = ?',
+            [(accessed_at, key) for key, accessed_at in touched.items()]
+        )
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO translations (key, translation, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+            rows
+        )
+        previous, self.writes = self.writes, self.writes + len(rows)
+        if self.writes // 100 > previous // 100:
+            self._evict_disk(now)
+        self.conn.commit()
+    
+    def _evict_disk(self, now):
+        # Drop expired rows, then the least recently used rows over the size limit
+        expired = self.conn.execute('DELETE FROM translations WHERE created_at < ?', (now - self.ttl,)).rowcount
+        overflow = self.conn.execute(
+            'DELETE FROM translations WHERE key IN ('
+            'SELECT key FROM translations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.disk_size,)
+        ).rowcount
+        self.stats['evictions'] += expired + overflow
+
+translation_cache = TranslationCache(
+    os.path.join(CACHE_DIR, 'translations.db'),
+    memory_size=int(os.getenv('TRANSLATION_CACHE_MEMORY_SIZE', '1024')),
+    disk_size=int(os.getenv('TRANSLATION_CACHE_DISK_SIZE', '50000')),
+    ttl=int(os.getenv('TRANSLATION_CACHE_TTL', str(30 * 24 * 3600)))
+)
+
+# Shared Anthropic client - one connection pool for the whole process
+ANTHROPIC_TIMEOUT = float(os.getenv('ANTHROPIC_TIMEOUT', '20'))
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv('ANTHROPIC_MAX_CONCURRENCY', '8'))
+anthropic_client = None
+anthropic_semaphore = None
+
+def init_anthropic_client():
+    """Create the long-lived AsyncAnthropic client. Called once from setup_hook."""
+    global anthropic_client, anthropic_semaphore
+    
+    if anthropic_client is None:
+        import anthropic
+        
+        anthropic_client = anthropic.AsyncAnthropic(
+            api_key=os.getenv('ANTHROPIC_API_KEY'),
+            timeout=ANTHROPIC_TIMEOUT,
+            max_retries=2
+        )
+        anthropic_semaphore = asyncio.Semaphore(ANTHROPIC_MAX_CONCURRENCY)
+        print(f"🤖 Anthropic client ready (timeout {ANTHROPIC_TIMEOUT}s, max {ANTHROPIC_MAX_CONCURRENCY} concurrent requests)")
+    
+    return anthropic_client
+
+async def close_anthropic_client():
+    """Close the shared client's connection pool."""
+    global anthropic_client
+    
+    if anthropic_client is not None:
+        await anthropic_client.close()
+        anthropic_client = None
+
+async def request_translation(text):
+    try:
+        client = init_anthropic_client()
         
         # Create translation prompt
         prompt = f"Translate the following Chinese text to Japanese. Only return the Japanese translation, no explanations: {text}"
         
-        # Get translation from Claude
-        message = client.messages.create(
-            model="claude-3-haiku-20240307",  # Using Haiku for cost efficiency
-            max_tokens=1000,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
+        # Get translation from Claude, bounded by the shared concurrency limit
+        async with anthropic_semaphore:
+            message = await client.messages.create(
+                model="claude-3-haiku-20240307",  # Using Haiku for cost efficiency
+                max_tokens=1000,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                timeout=ANTHROPIC_TIMEOUT
+            )
         
         return message.content[0].text.strip()
         
@@ -349,7 +853,125 @@ def translate_chinese_to_japanese(text):
         print(f"Translation error: {e}")
         return "Translation failed"
 
-def create_image(text):
+async def request_batch_translation(lines):
+    """Translate several lines in one Claude request. Returns None if the reply can't be parsed."""
+    try:
+        client = init_anthropic_client()
+        
+        # Ask for a JSON array so results can be mapped back line by line
+        prompt = (
+            "Translate each Chinese line in the following JSON array to Japanese. "
+            "Return only a JSON array of strings with exactly one translation per line, "
+            f"in the same order, no explanations: {json.dumps(lines, ensure_ascii=False)}"
+        )
+        
+        async with anthropic_semaphore:
+            message = await client.messages.create(
+                model="claude-3-haiku-20240307",
+                max_tokens=min(1000 * len(lines), 4096),
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                timeout=ANTHROPIC_TIMEOUT
+            )
+        
+        reply = message.content[0].text
+        translations = json.loads(reply[reply.index('['):reply.rindex(']') + 1])
+        
+        if (not isinstance(translations, list) or len(translations) != len(lines)
+                or not all(isinstance(item, str) for item in translations)):
+            print(f"Batch translation returned {len(translations)} items for {len(lines)} lines")
+            return None
+        
+        return [item.strip() for item in translations]
+        
+    except ValueError as e:
+        print(f"Batch translation parse error: {e}")
+        return None
+    except Exception as e:
+        print(f"Batch translation error: {e}")
+        return None
+
+async def translate_lines(lines):
+    """Translate all lines of a message with at most one batched Claude request."""
+    translations = await translation_cache.get_many(lines)
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    
+    if not missing:
+        return translations
+    
+    missing_lines = [lines[i] for i in missing]
+    
+    with STAGE_SECONDS.labels('translation').time():
+        if len(missing_lines) == 1:
+            results = [await request_translation(missing_lines[0])]
+        else:
+            results = await request_batch_translation(missing_lines)
+            if results is None:
+                # Fall back to one request per line
+                print(f"⚠️ Falling back to per-line translation for {len(missing_lines)} lines")
+                results = await asyncio.gather(*(request_translation(line) for line in missing_lines))
+    
+    fresh = []
+    for i, translation in zip(missing, results):
+        translations[i] = translation
+        if translation != "Translation failed":
+            fresh.append((lines[i], translation))
+        else:
+            ERRORS.labels('translation').inc()
+    
+    if fresh:
+        await translation_cache.put_many(fresh)
+    
+    return translations
+
+# Output encoder - picks resolution and format so uploads stay small
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'png').lower()  # 'png', 'png-palette' or 'webp'
+PNG_OPTIMIZE = os.getenv('PNG_OPTIMIZE', 'false').lower() in ('1', 'true', 'yes')  # ~3x slower for ~3% smaller files
+TARGET_IMAGE_WIDTH = int(os.getenv('TARGET_IMAGE_WIDTH', '1600'))
+MIN_RENDER_DPI = 100
+MAX_RENDER_DPI = 300
+PALETTE_COLORS = 64
+EXIF_IMAGE_DESCRIPTION = 0x010E
+IMAGE_FILENAMES = {
+    'png': 'pinyin_translation.png',
+    'png-palette': 'pinyin_translation.png',
+    'webp': 'pinyin_translation.webp',
+}
+
+def choose_dpi(width_inches):
+    """DPI that renders width_inches at about TARGET_IMAGE_WIDTH pixels, within sane bounds."""
+    return max(MIN_RENDER_DPI, min(MAX_RENDER_DPI, round(TARGET_IMAGE_WIDTH / width_inches)))
+
+def image_filename():
+    return IMAGE_FILENAMES.get(IMAGE_FORMAT, 'pinyin_translation.png')
+
+def encode_image(image, chinese_text):
+    """Encode a rendered image as IMAGE_FORMAT, embedding chinese_text, and return a buffer."""
+    buf = io.BytesIO()
+    
+    if IMAGE_FORMAT == 'webp':
+        # WebP has no text chunks, so the text goes in the ASCII-only EXIF image description as JSON
+        exif = Image.Exif()
+        exif[EXIF_IMAGE_DESCRIPTION] = json.dumps(chinese_text)
+        image.save(buf, format='webp', lossless=True, method=4, exif=exif.tobytes())
+    else:
+        # Keep the chinese_text chunk the audio button falls back to
+        png_info = PngInfo()
+        png_info.add_text('chinese_text', chinese_text)
+        
+        if IMAGE_FORMAT == 'png-palette':
+            # Anti-aliased text on white needs only a few dozen colours
+            image = image.quantize(colors=PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+        
+        image.save(buf, format='png', pnginfo=png_info, optimize=PNG_OPTIMIZE)
+    
+    print(f"🖼️ Encoded {image.width}x{image.height} {IMAGE_FORMAT} image: {buf.tell() / 1024:.0f} KiB")
+    buf.seek(0)
+    
+    return buf
+
+def create_image(text, japanese_translation):
     """Create image for single line of text with proper mixed language handling."""
     if not text.strip():
         return None
@@ -359,129 +981,722 @@ def create_image(text):
         if not has_chinese_content(text):
             return None
         
-        # Tokenize text into segments
-        segments = tokenize_text(text.strip())
-        processed_segments = get_pinyin_for_segments(segments)
+        # Tokenize into Chinese / non-Chinese spans, then convert the Chinese ones
+        original_line = text.strip()
+        with STAGE_SECONDS.labels('tokenize').time():
+            spans = list(tokenize_spans(original_line))
+        with STAGE_SECONDS.labels('pinyin').time():
+            pinyin_line = spans_to_pinyin(original_line, spans)
         
-        # Get Japanese translation for the entire text
-        japanese_translation = translate_chinese_to_japanese(text.strip())
+        with STAGE_SECONDS.labels('render').time():
+            if RENDER_BACKEND == 'pillow':
+                image = draw_pillow(pinyin_line, original_line, japanese_translation)
+            else:
+                image = draw_figure(pinyin_line, original_line, japanese_translation)
         
-        # Calculate figure dimensions based on text length
-        text_length = len(text.strip())
-        fig_width = max(text_length * 0.6, 8)
-        fig_height = 6  # Fixed height for single line
+        with STAGE_SECONDS.labels('encode').time():
+            return encode_image(image, original_line)
+    except Exception as e:
+        ERRORS.labels('render').inc()
+        print(f"Error creating image: {e}")
+        return None
+
+# (point size, weight, colour, vertical centre in inches from the top line). This is the
+# original layout: lines 0.2 axes-heights apart, with the axes 77% of a 6-inch figure.
+FIGURE_LINES = {
+    'pinyin': (16, 'normal', 'black', 0.0),
+    'original': (22, 'bold', 'black', 0.924),
+    'japanese': (14, 'normal', 'blue', 1.848),
+}
+
+@lru_cache(maxsize=None)
+def cjk_font_properties(size, weight):
+    """FontProperties for one line style, built once and shared by every renderer."""
+    from matplotlib.font_manager import FontProperties
+    return FontProperties(family=['Noto Sans CJK SC', 'Noto Sans CJK JP'], size=size, weight=weight)
+
+class FigureRenderer:
+    """A Figure, Agg canvas and the three text artists, reused for every image one thread draws.
+    
+    Uses the object-oriented API only, so nothing is registered with pyplot
+    and there is no figure to close - or leak - when drawing fails.
+    """
+    
+    def __init__(self):
+        load_matplotlib()
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
         
-        fig, ax = plt.subplots(figsize=(fig_width, fig_height))
+        self.figure = Figure(facecolor='white', edgecolor='none')
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.texts = {
+            name: self.figure.text(0.5, 0.5, '', ha='center', va='center', color=color,
+                                   fontproperties=cjk_font_properties(size, weight))
+            for name, (size, weight, color, _) in FIGURE_LINES.items()
+        }
+    
+    def measure(self, texts, dpi):
+        """Set the line texts and return each one's (width, height) in pixels at dpi."""
+        self.figure.set_dpi(dpi)
+        renderer = self.canvas.get_renderer()
+        sizes = {}
+        for name, text in texts.items():
+            self.texts[name].set_text(text)
+            extent = self.texts[name].get_window_extent(renderer)
+            sizes[name] = (extent.width, extent.height)
+        return sizes
+    
+    def render(self, texts, dpi):
+        """Draw the lines into a canvas sized to their tight bounding box plus padding."""
+        sizes = self.measure(texts, dpi)
+        pad = 0.3 * dpi
         
-        # Find suitable fonts
-        cjk_font = fm.FontProperties(family=['Noto Sans CJK SC', 'Noto Sans CJK JP'])
-        regular_font = fm.FontProperties(family=['DejaVu Sans', 'Arial'])
+        # Tight box from the measured extents, so the figure is drawn exactly once.
+        # Empty lines (e.g. a timed-out translation) still report a line height, so leave them out
+        visible = {name: size for name, size in sizes.items() if texts[name]} or sizes
+        top = min(FIGURE_LINES[name][3] * dpi - height / 2 for name, (_, height) in visible.items())
+        bottom = max(FIGURE_LINES[name][3] * dpi + height / 2 for name, (_, height) in visible.items())
+        width_px = math.ceil(max(width for width, _ in visible.values()) + 2 * pad)
+        height_px = math.ceil(bottom - top + 2 * pad)
+        self.figure.set_size_inches(width_px / dpi, height_px / dpi)
         
-        # Create pinyin line by combining all segments
-        pinyin_line = ''.join(seg['pinyin'] for seg in processed_segments)
-        original_line = text.strip()
+        for name, artist in self.texts.items():
+            centre = FIGURE_LINES[name][3] * dpi - top + pad
+            artist.set_y(1 - centre / height_px)
         
-        # Center everything vertically
-        y_positions = {
-            'pinyin': 0.7,    # Top
-            'original': 0.5,  # Middle
-            'japanese': 0.3   # Bottom
-        }
+        self.canvas.draw()
+        size = self.canvas.get_width_height()
+        return Image.frombuffer('RGBA', size, self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).convert('RGB')
+
+figure_renderers = threading.local()
+
+def draw_figure(pinyin_line, original_line, japanese_translation, dpi=None):
+    """Draw the three text lines with matplotlib and return a PIL image. Safe to call from any thread."""
+    renderer = getattr(figure_renderers, 'renderer', None)
+    if renderer is None:
+        renderer = figure_renderers.renderer = FigureRenderer()
+    
+    texts = {'pinyin': pinyin_line, 'original': original_line, 'japanese': japanese_translation}
+    
+    if dpi is None:
+        # Measure at a reference resolution to pick the DPI that hits the target width
+        sizes = renderer.measure(texts, 100)
+        dpi = choose_dpi(max(width for width, _ in sizes.values()) / 100 + 0.6)
+    
+    return renderer.render(texts, dpi)
+
+# Pillow renderer - same layout as draw_figure, drawn with FreeType directly
+RENDER_BACKEND = os.getenv('RENDER_BACKEND', 'matplotlib').lower()  # 'matplotlib' or 'pillow'
+PILLOW_FONT_REGULAR = os.getenv('PILLOW_FONT_REGULAR', '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc')
+PILLOW_FONT_BOLD = os.getenv('PILLOW_FONT_BOLD', '/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc')
+PILLOW_FONT_INDEX = int(os.getenv('PILLOW_FONT_INDEX', '2'))  # Noto Sans CJK SC within the .ttc collection
+
+# (font path, point size, colour, vertical centre in inches from the top line), as in FIGURE_LINES
+PILLOW_LINES = {
+    'pinyin': (PILLOW_FONT_REGULAR, 16, 'black', 0.0),
+    'original': (PILLOW_FONT_BOLD, 22, 'black', 0.924),
+    'japanese': (PILLOW_FONT_REGULAR, 14, 'blue', 1.848),
+}
+
+@lru_cache(maxsize=32)
+def load_pillow_font(path, size_px):
+    """Load a FreeType font once per (path, pixel size)."""
+    try:
+        return ImageFont.truetype(path, size_px, index=PILLOW_FONT_INDEX if path.endswith('.ttc') else 0)
+    except OSError:
+        print(f"⚠️ Font {path} not found, using Pillow's default font")
+        return ImageFont.load_default(size_px)
+
+# Units cached as one bitmap: whitespace runs, Latin words and pinyin syllables, or any other single character
+GLYPH_UNIT_RE = re.compile(r"\s+|[0-9A-Za-z\u00c0-\u024f\u0300-\u036f'’-]+|.")
+GLYPH_CACHE_SIZE = int(os.getenv('GLYPH_CACHE_SIZE', '8192'))
+
+class GlyphCache:
+    """Bounded LRU of rasterized glyph masks keyed by (font path, pixel size, unit).
+    
+    Chat lines reuse a small vocabulary, so most hanzi and syllables are
+    rasterized once and afterwards only blitted.
+    """
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (path, size_px, unit) -> (mask or None, left, top, advance)
+        self.lock = threading.Lock()  # shared by the render threads
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def get(self, path, size_px, unit):
+        key = (path, size_px, unit)
+        with self.lock:
+            glyph = self.entries.get(key)
+            if glyph is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return glyph, True
         
-        # Draw pinyin (top line)
-        ax.text(0.5, y_positions['pinyin'], pinyin_line, 
-               fontsize=16, ha='center', va='center', 
-               fontproperties=cjk_font, weight='normal')
-        
-        # Draw original text (middle line, bold)
-        ax.text(0.5, y_positions['original'], original_line, 
-               fontsize=22, ha='center', va='center', 
-               fontproperties=cjk_font, weight='bold')
-        
-        # Draw Japanese translation (bottom line)
-        ax.text(0.5, y_positions['japanese'], japanese_translation, 
-               fontsize=14, ha='center', va='center', 
-               color='blue', fontproperties=cjk_font)
-        
-        ax.set_xlim(0, 1)
-        ax.set_ylim(0, 1)
-        ax.axis('off')
-        
-        # Save to bytes buffer with tight layout
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', dpi=300, 
-           facecolor='white', edgecolor='none', pad_inches=0.3,
-           metadata={'chinese_text': original_line})
-           
-        plt.close()
-        buf.seek(0)
-        
-        return buf
-    except Exception as e:
-        print(f"Error creating image: {e}")
+        glyph = self.rasterize(load_pillow_font(path, size_px), unit)
+        
+        with self.lock:
+            self.entries[key] = glyph
+            self.stats['misses'] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return glyph, False
+    
+    @staticmethod
+    def rasterize(font, unit):
+        """Render one unit to an 'L' mask, positioned relative to its baseline origin."""
+        advance = font.getlength(unit)
+        left, top, right, bottom = font.getbbox(unit, anchor='ls')
+        if right <= left or bottom <= top:
+            return None, 0, 0, advance  # whitespace - advance only
+        
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text((-left, -top), unit, font=font, fill=255, anchor='ls')
+        return mask, left, top, advance
+
+glyph_cache = GlyphCache(GLYPH_CACHE_SIZE)
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def glyph_advance(path, size_px, unit):
+    """Advance width of one unit, without rasterizing it."""
+    return load_pillow_font(path, size_px).getlength(unit)
+
+def line_advance(text, path, size_px):
+    """Width of the line as compose_line lays it out, summed from cached advances."""
+    return sum(glyph_advance(path, size_px, unit) for unit in GLYPH_UNIT_RE.findall(text))
+
+def compose_line(text, path, size_px):
+    """Blit cached glyphs into one mask for the line.
+    
+    Returns the mask (None if nothing is visible) and its ink box relative to
+    the line's 'mm' anchor, matching ImageDraw.textbbox(..., anchor='mm').
+    """
+    placed = []
+    x = 0.0
+    hits = misses = 0
+    for unit in GLYPH_UNIT_RE.findall(text):
+        (mask, left, top, advance), hit = glyph_cache.get(path, size_px, unit)
+        if hit:
+            hits += 1
+        else:
+            misses += 1
+        if mask is not None:
+            placed.append((mask, round(x) + left, top))
+        x += advance
+    
+    CACHE_LOOKUPS.labels('glyph', 'hit').inc(hits)
+    CACHE_LOOKUPS.labels('glyph', 'miss').inc(misses)
+    
+    if not placed:
+        return None, (0, 0, 0, 0)
+    
+    ink_left = min(px for _, px, _ in placed)
+    ink_top = min(py for _, _, py in placed)
+    ink_right = max(px + mask.width for mask, px, _ in placed)
+    ink_bottom = max(py + mask.height for mask, _, py in placed)
+    
+    line = Image.new('L', (ink_right - ink_left, ink_bottom - ink_top), 0)
+    for mask, px, py in placed:
+        line.paste(mask, (px - ink_left, py - ink_top), mask)
+    
+    # 'mm' anchor: middle of the advance width, halfway between ascender and descender
+    ascent, descent = load_pillow_font(path, size_px).getmetrics()
+    anchor_x = round(x / 2)
+    anchor_y = round((descent - ascent) / 2)
+    return line, (ink_left - anchor_x, ink_top - anchor_y, ink_right - anchor_x, ink_bottom - anchor_y)
+
+def draw_pillow(pinyin_line, original_line, japanese_translation, dpi=None):
+    """Draw the three text lines with Pillow and return a PIL image."""
+    texts = {'pinyin': pinyin_line, 'original': original_line, 'japanese': japanese_translation}
+    
+    if dpi is None:
+        # Measure at a reference resolution to pick the DPI that hits the target width
+        width = max(line_advance(texts[name], path, round(points * 100 / 72))
+                    for name, (path, points, _, _) in PILLOW_LINES.items())
+        dpi = choose_dpi(width / 100 + 0.6)
+    
+    # Compose each line from cached glyphs, then place the lines around x=0
+    lines = []
+    left = top = float('inf')
+    right = bottom = float('-inf')
+    for name, (path, points, color, y_inches) in PILLOW_LINES.items():
+        mask, (line_left, line_top, line_right, line_bottom) = compose_line(texts[name], path, round(points * dpi / 72))
+        if mask is None:
+            continue
+        y = round(y_inches * dpi)
+        lines.append((mask, ImageColor.getrgb(color), line_left, line_top + y))
+        left, top = min(left, line_left), min(top, line_top + y)
+        right, bottom = max(right, line_right), max(bottom, line_bottom + y)
+    
+    pad = round(0.3 * dpi)
+    if not lines:
+        return Image.new('RGB', (2 * pad, 2 * pad), 'white')
+    
+    image = Image.new('RGB', (right - left + 2 * pad, bottom - top + 2 * pad), 'white')
+    for mask, color, line_left, line_top in lines:
+        image.paste(color, (pad - left + line_left, pad - top + line_top), mask)
+    
+    return image
+
+# Render worker pool - keeps matplotlib and Claude calls off the event loop
+RENDER_POOL = os.getenv('RENDER_POOL', 'thread').lower()  # 'thread' or 'process'
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '4'))
+render_executor = None
+
+def get_render_executor():
+    """Create the render executor on first use."""
+    global render_executor
+    
+    if render_executor is None:
+        if RENDER_POOL == 'process':
+            render_executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+        else:
+            render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='render')
+        print(f"🎨 Started {RENDER_POOL} render pool with {RENDER_WORKERS} workers")
+    
+    return render_executor
+
+def warm_matplotlib():
+    """Pool-friendly warm-up: load_matplotlib returns the module, which can't be pickled back from a process."""
+    load_matplotlib()
+
+async def render_image(text, japanese_translation):
+    """Run create_image in the render pool and await the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_render_executor(), create_image, text, japanese_translation)
+
+def shutdown_render_executor():
+    """Stop the render pool, waiting for in-flight jobs."""
+    global render_executor
+    
+    if render_executor is not None:
+        render_executor.shutdown(wait=True)
+        render_executor = None
+
+# Pinyin job queue - bounds in-flight messages and applies backpressure
+PINYIN_WORKERS = int(os.getenv('PINYIN_WORKERS', '4'))
+PINYIN_QUEUE_SIZE = int(os.getenv('PINYIN_QUEUE_SIZE', '100'))
+QUEUE_OVERFLOW = os.getenv('QUEUE_OVERFLOW', 'reply').lower()  # 'reply' or 'drop'
+REPLY_DELAY = float(os.getenv('REPLY_DELAY', '0.5'))
+# Reply with the pinyin right away and edit the image in once it is ready
+PROGRESSIVE_REPLIES = os.getenv('PROGRESSIVE_REPLIES', 'true').lower() in ('1', 'true', 'yes')
+PROGRESSIVE_TRANSLATION_TIMEOUT = float(os.getenv('PROGRESSIVE_TRANSLATION_TIMEOUT', '10'))
+PROGRESS_NOTE = "⏳ Translating and drawing..."
+FAILURE_NOTE = "⚠️ Sorry, there was an error drawing this line."
+
+class PinyinJobQueue:
+    """Fixed pool of worker tasks serving per-guild job queues with deficit round robin.
+    
+    Each guild with queued work gets `quantum` lines of credit times its
+    weight per round, so one busy guild cannot starve the others.
+    """
+    
+    def __init__(self, workers, max_size, quantum=4):
+        self.workers = workers
+        self.max_size = max_size
+        self.quantum = quantum
+        self.guild_queues = {}  # guild_id -> deque of (message, chinese_lines, placeholders, enqueued_at)
+        self.deficits = {}  # guild_id -> line credit
+        self.rotation = deque()  # guilds with queued jobs, in round-robin order
+        self.size = 0
+        self.available = None  # semaphore counting queued jobs, created in start()
+        self.tasks = []
+        self.stats = {'submitted': 0, 'rejected': 0, 'completed': 0}
+    
+    def start(self):
+        self.available = asyncio.Semaphore(0)
+        self.tasks = [asyncio.create_task(self.worker(i)) for i in range(self.workers)]
+        print(f"🧵 Started {self.workers} pinyin workers (queue limit {self.max_size})")
+    
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+    
+    def depth(self):
+        return self.size
+    
+    def submit(self, message, chinese_lines, placeholders=None):
+        """Queue a job without waiting. Returns False if the queue is full."""
+        if self.size >= self.max_size:
+            self.stats['rejected'] += 1
+            print(f"🚫 Pinyin queue full ({self.max_size}), rejecting message {message.id} in channel {message.channel.id}")
+            return False
+        
+        guild_id = message.guild.id if message.guild else None
+        if guild_id not in self.guild_queues:
+            self.guild_queues[guild_id] = deque()
+            self.deficits[guild_id] = 0
+            self.rotation.append(guild_id)
+        
+        self.guild_queues[guild_id].append((message, chinese_lines, placeholders, time.perf_counter()))
+        self.size += 1
+        self.stats['submitted'] += 1
+        self.available.release()
+        return True
+    
+    def rounds_needed(self, guild_id):
+        """Rounds of credit the guild needs before its next job is affordable."""
+        missing = len(self.guild_queues[guild_id][0][1]) - self.deficits[guild_id]
+        if missing <= 0:
+            return 0
+        credit = self.quantum * admission.weight(guild_id)
+        rounds = math.ceil(missing / credit)
+        # Guard against the division rounding down
+        return rounds if rounds * credit >= missing else rounds + 1
+    
+    def next_job(self):
+        """Pick the next job by deficit round robin over guilds, weighting by line count.
+        
+        Rather than crediting guilds one round at a time, work out how many
+        rounds each guild needs and apply them in one step - the same result
+        as the round-by-round loop, in time linear in the number of guilds.
+        """
+        rounds = [self.rounds_needed(guild_id) for guild_id in self.rotation]
+        index = min(range(len(rounds)), key=rounds.__getitem__)  # first in rotation order wins ties
+        
+        # Every guild is credited for the full rounds; those ahead of the winner also failed its round
+        for i, guild_id in enumerate(self.rotation):
+            credits = rounds[index] + (1 if i < index else 0)
+            if credits:
+                self.deficits[guild_id] += credits * (self.quantum * admission.weight(guild_id))
+        self.rotation.rotate(-index)
+        
+        guild_id = self.rotation[0]
+        queue = self.guild_queues[guild_id]
+        self.deficits[guild_id] -= len(queue[0][1])
+        job = queue.popleft()
+        self.size -= 1
+        if not queue:
+            # Idle guilds don't bank credit
+            self.rotation.popleft()
+            del self.guild_queues[guild_id]
+            del self.deficits[guild_id]
+        return guild_id, job
+    
+    async def worker(self, index):
+        while True:
+            await self.available.acquire()
+            guild_id, (message, chinese_lines, placeholders, enqueued_at) = self.next_job()
+            wait = time.perf_counter() - enqueued_at
+            print(f"📥 Worker {index} picked up {len(chinese_lines)} lines for guild {guild_id} after {wait * 1000:.0f}ms "
+                  f"(queue depth {self.depth()}, {len(self.rotation)} guilds waiting)")
+            
+            try:
+                await process_pinyin_job(message, chinese_lines, placeholders)
+            except Exception as e:
+                print(f"Error in pinyin worker {index}: {e}")
+            finally:
+                self.stats['completed'] += 1
+
+
+# Per-guild and per-user quotas, in lines per minute
+GUILD_LINES_PER_MINUTE = float(os.getenv('GUILD_LINES_PER_MINUTE', '120'))
+USER_LINES_PER_MINUTE = float(os.getenv('USER_LINES_PER_MINUTE', '30'))
+GUILD_LIMITS_COLLECTION = 'guild_limits'
+
+# Allowed range for each !limits setting; admins may lower quotas, only the bot owner may raise them or set weights
+LIMIT_RANGES = {
+    'guild_lines_per_minute': (1, GUILD_LINES_PER_MINUTE * 10),
+    'user_lines_per_minute': (1, USER_LINES_PER_MINUTE * 10),
+    'weight': (0.1, 10),
+}
+LIMIT_DEFAULTS = {
+    'guild_lines_per_minute': GUILD_LINES_PER_MINUTE,
+    'user_lines_per_minute': USER_LINES_PER_MINUTE,
+    'weight': 1,
+}
+
+def clamp_limit(name, value):
+    low, high = LIMIT_RANGES[name]
+    return max(low, min(high, value))
+
+class TokenBucket:
+    """Refills at rate_per_minute up to a one-minute burst.
+    
+    A request larger than the burst is allowed once the bucket is full and
+    puts it into debt, so big pastes are delayed rather than refused forever.
+    """
+    
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+    
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def allows(self, amount):
+        self.refill()
+        return self.tokens >= min(amount, self.capacity)
+    
+    def consume(self, amount):
+        self.tokens -= amount
+    
+    def is_full(self):
+        self.refill()
+        return self.tokens >= self.capacity
+
+class AdmissionController:
+    """Applies guild and user token buckets before jobs reach the queue."""
+    
+    def __init__(self):
+        self.limits = {}  # guild_id -> {'guild_lines_per_minute', 'user_lines_per_minute', 'weight'}
+        self.guild_buckets = {}
+        self.user_buckets = {}
+        self.notified = {}  # bucket key -> last time we told the user to slow down
+        self.last_prune = time.monotonic()
+        self.stats = {'admitted': 0, 'guild_limited': 0, 'user_limited': 0}
+    
+    def limit(self, guild_id, name):
+        # Clamped on read too, so values saved before the ranges existed are still bounded
+        return clamp_limit(name, self.limits.get(guild_id, {}).get(name, LIMIT_DEFAULTS[name]))
+    
+    def guild_rate(self, guild_id):
+        return self.limit(guild_id, 'guild_lines_per_minute')
+    
+    def user_rate(self, guild_id):
+        return self.limit(guild_id, 'user_lines_per_minute')
+    
+    def weight(self, guild_id):
+        return self.limit(guild_id, 'weight')
+    
+    def buckets(self, message):
+        guild_id = message.guild.id if message.guild else None
+        user_key = (guild_id, message.author.id)
+        
+        if user_key not in self.user_buckets:
+            self.user_buckets[user_key] = TokenBucket(self.user_rate(guild_id))
+        if guild_id not in self.guild_buckets:
+            self.guild_buckets[guild_id] = TokenBucket(self.guild_rate(guild_id))
+        return self.user_buckets[user_key], self.guild_buckets[guild_id]
+    
+    def check(self, message, line_count):
+        """Return None if the lines may be processed, or 'guild'/'user' naming the exhausted quota.
+        
+        Nothing is charged here; call charge() once the job is actually queued.
+        """
+        self.prune()
+        user_bucket, guild_bucket = self.buckets(message)
+        
+        if not user_bucket.allows(line_count):
+            self.stats['user_limited'] += 1
+            return 'user'
+        if not guild_bucket.allows(line_count):
+            self.stats['guild_limited'] += 1
+            return 'guild'
         return None
+    
+    def charge(self, message, line_count):
+        """Take the lines from both buckets after check() passed and the job was queued."""
+        for bucket in self.buckets(message):
+            bucket.consume(line_count)
+        self.stats['admitted'] += 1
+    
+    def prune(self, interval=60):
+        """Drop refilled buckets and stale notices - a full bucket is the same as a new one."""
+        now = time.monotonic()
+        if now - self.last_prune < interval:
+            return
+        self.last_prune = now
+        
+        for buckets in (self.user_buckets, self.guild_buckets):
+            for key in [key for key, bucket in buckets.items() if bucket.is_full()]:
+                del buckets[key]
+        for key in [key for key, notified_at in self.notified.items() if now - notified_at >= 60]:
+            del self.notified[key]
+    
+    def should_notify(self, key):
+        """Only tell a user or guild to slow down once a minute."""
+        now = time.monotonic()
+        if now - self.notified.get(key, 0) < 60:
+            return False
+        self.notified[key] = now
+        return True
+    
+    def set_limit(self, guild_id, name, value):
+        self.limits.setdefault(guild_id, {})[name] = clamp_limit(name, value)
+        
+        # Rebuild this guild's buckets with the new rates
+        self.guild_buckets.pop(guild_id, None)
+        for key in [key for key in self.user_buckets if key[0] == guild_id]:
+            del self.user_buckets[key]
+    
+    async def load(self):
+        """Load admin-set limits from Firestore."""
+        docs = await run_firestore(lambda: list(db.collection(GUILD_LIMITS_COLLECTION).stream(timeout=FIRESTORE_TIMEOUT)))
+        self.limits = {int(doc.id): doc.to_dict() for doc in docs}
+        print(f"✅ Loaded custom limits for {len(self.limits)} guilds")
+    
+    async def save(self, guild_id):
+        doc_ref = db.collection(GUILD_LIMITS_COLLECTION).document(str(guild_id))
+        await run_firestore(doc_ref.set, self.limits.get(guild_id, {}))
+
+admission = AdmissionController()
+
+pinyin_queue = PinyinJobQueue(PINYIN_WORKERS, PINYIN_QUEUE_SIZE)
+QUEUE_DEPTH.set_function(pinyin_queue.depth)
+ACTIVE_CHANNELS.set_function(lambda: len(active_channels))
 
 # Discord bot setup
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)  # Disable default help
+
+class PinyinBot(commands.AutoShardedBot):
+    startup_logged = False
+    channels_loaded = False
+    
+    async def setup_hook(self):
+        # Create long-lived clients once, before connecting to the gateway
+        started = time.perf_counter()
+        init_anthropic_client()
+        record_startup_phase('anthropic client', started)
+        
+        # Import matplotlib in the render pool while the gateway connects. With
+        # RENDER_POOL=process this only reaches one worker; the others import on first render
+        if RENDER_BACKEND == 'matplotlib':
+            warmup = asyncio.get_running_loop().run_in_executor(get_render_executor(), warm_matplotlib)
+            warmup.add_done_callback(self.report_warmup)
+        self.gateway_started = time.perf_counter()
+        
+        # Route Play Audio clicks by custom_id so buttons survive restarts
+        self.add_dynamic_items(AudioButton)
+        
+        # Flush channel changes to Firestore in the background
+        channel_journal.start()
+        
+        # Start the workers that process Chinese messages
+        pinyin_queue.start()
+    
+    @staticmethod
+    def report_warmup(future):
+        # Nothing awaits the warm-up, so surface its failure here; the first render will retry the import
+        if not future.cancelled() and future.exception() is not None:
+            print(f"⚠️ matplotlib warm-up failed: {future.exception()}")
+    
+    async def close(self):
+        await pinyin_queue.stop()
+        await channel_journal.stop()
+        await close_anthropic_client()
+        await super().close()
+
+bot = PinyinBot(
+    command_prefix='!',
+    intents=intents,
+    help_command=None,  # Disable default help
+    shard_count=SHARD_COUNT,
+    shard_ids=SHARD_IDS
+)
 
 @bot.event
 async def on_ready():
     print(f'🤖 {bot.user} has connected to Discord!')
-    print(f'🏠 Bot is in {len(bot.guilds)} guilds')
+    print(f'🏠 Bot is in {len(bot.guilds)} guilds on shards {sorted(bot.shards)} of {bot.shard_count}')
+    
+    if not bot.startup_logged:
+        record_startup_phase('gateway', bot.gateway_started)
+    
+    # on_ready fires again on every reconnect; after the first load the guild
+    # and channel events below keep active_channels current
+    if bot.channels_loaded:
+        print(f"🔁 Reconnected, keeping {len(active_channels)} active channels")
+        return
     
     # Load active channels from Firestore
     try:
+        started = time.perf_counter()
         await load_active_channels()
         print(f"📋 Successfully loaded channel data")
+        if not bot.startup_logged:
+            record_startup_phase('load channels', started)
     except Exception as e:
         print(f"❌ CRITICAL: Failed to load channels: {e}")
         raise e
     
-    # Clean up invalid channels (channels that no longer exist)
+    # Load admin-set quotas (non-fatal - defaults apply if this fails)
+    try:
+        await admission.load()
+    except Exception as e:
+        print(f"⚠️ Failed to load guild limits, using defaults: {e}")
+    
+    # Drop channels deleted while the bot was offline
     try:
         await cleanup_invalid_channels()
         print(f"🧹 Channel cleanup completed")
     except Exception as e:
         print(f"❌ CRITICAL: Failed to cleanup channels: {e}")
         raise e
+    
+    bot.channels_loaded = True
+    
+    if not bot.startup_logged:
+        bot.startup_logged = True
+        log_startup_timings()
 
 async def cleanup_invalid_channels():
     """Remove channels that no longer exist or bot no longer has access to."""
     invalid_channels = set()
     
-    for guild_id, channel_id in active_channels.copy():
-        try:
-            if guild_id is None:  # DM channel
-                channel = bot.get_channel(channel_id)
-                if channel is None:
-                    invalid_channels.add((guild_id, channel_id))
-            else:  # Guild channel
-                guild = bot.get_guild(guild_id)
-                if guild is None:
-                    invalid_channels.add((guild_id, channel_id))
-                    continue
-                
-                channel = guild.get_channel(channel_id)
-                if channel is None:
-                    invalid_channels.add((guild_id, channel_id))
-        except Exception as e:
-            print(f"Error checking channel {guild_id}/{channel_id}: {e}")
-            invalid_channels.add((guild_id, channel_id))
+    for guild_id in list(active_channels.guilds):
+        if guild_id is None:  # DM channels
+            for channel_key in active_channels.guild_channels(None):
+                if bot.get_channel(channel_key[1]) is None:
+                    invalid_channels.add(channel_key)
+            continue
+        
+        # Look each guild up once, and drop all its channels if the bot left it
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            invalid_channels.update(active_channels.guild_channels(guild_id))
+            continue
+        
+        for channel_key in active_channels.guild_channels(guild_id):
+            try:
+                if guild.get_channel_or_thread(channel_key[1]) is None:
+                    invalid_channels.add(channel_key)
+            except Exception as e:
+                print(f"Error checking channel {guild_id}/{channel_key[1]}: {e}")
+                invalid_channels.add(channel_key)
     
     if invalid_channels:
-        for channel_key in invalid_channels:
-            active_channels.discard(channel_key)
-        
         print(f"🧹 Cleaned up {len(invalid_channels)} invalid channels")
         try:
-            await save_active_channels()
-            print(f"✅ Successfully saved cleanup results to Firestore")
+            remove_active_channels(invalid_channels)
+            print(f"✅ Queued cleanup results for Firestore")
         except Exception as e:
             print(f"❌ CRITICAL: Failed to save cleanup results: {e}")
             raise e
 
+def drop_channels(channel_keys, reason):
+    """Deactivate channels that went away, if any of them were active."""
+    channel_keys = [channel_key for channel_key in channel_keys if channel_key in active_channels]
+    if channel_keys:
+        remove_active_channels(channel_keys)
+        print(f"🧹 Removed {len(channel_keys)} active channels: {reason}")
+
+@bot.event
+async def on_guild_remove(guild):
+    drop_channels(active_channels.guild_channels(guild.id), f"left guild {guild.id}")
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    drop_channels([(channel.guild.id, channel.id)], f"channel {channel.id} deleted")
+
+@bot.event
+async def on_raw_thread_delete(payload):
+    # Raw event so threads missing from the cache are handled too
+    drop_channels([(payload.guild_id, payload.thread_id)], f"thread {payload.thread_id} deleted")
+
+@bot.event
+async def on_thread_update(before, after):
+    if after.archived and not before.archived:
+        drop_channels([(after.guild.id, after.id)], f"thread {after.id} archived")
+
 @bot.command(name='init')
 async def init_channel(ctx):
     """Initialize the current channel for pinyin functionality."""
@@ -495,18 +1710,13 @@ async def init_channel(ctx):
         await ctx.send(f"📌 This channel is already initialized for pinyin functionality!")
         return
     
-    # Add channel to active channels
-    active_channels.add(channel_key)
-    
-    # Save to Firestore
+    # Add channel to active channels - written to Firestore by the journal flusher
     try:
-        await save_active_channels()
-        print(f"✅ Successfully saved new channel to Firestore")
+        add_active_channel(channel_key)
+        print(f"✅ Queued new channel for Firestore")
     except Exception as e:
         print(f"❌ CRITICAL: Failed to save channel: {e}")
-        # Remove from memory since save failed
-        active_channels.discard(channel_key)
-        await ctx.send(f"❌ **Critical Error**: Failed to save channel to Firestore!\n```{str(e)}```")
+        await ctx.send(f"❌ **Critical Error**: Failed to save channel!\n```{str(e)}```")
         return
     
     guild_name = ctx.guild.name if ctx.guild else "DM"
@@ -538,18 +1748,13 @@ async def remove_channel(ctx):
         await ctx.send(f"❌ This channel is not initialized for pinyin functionality!")
         return
     
-    # Remove channel from active channels
-    active_channels.remove(channel_key)
-    
-    # Save to Firestore
+    # Remove channel from active channels - deleted from Firestore by the journal flusher
     try:
-        await save_active_channels()
-        print(f"✅ Successfully removed channel from Firestore")
+        remove_active_channels([channel_key])
+        print(f"✅ Queued channel removal for Firestore")
     except Exception as e:
         print(f"❌ CRITICAL: Failed to remove channel: {e}")
-        # Add back to memory since save failed
-        active_channels.add(channel_key)
-        await ctx.send(f"❌ **Critical Error**: Failed to remove channel from Firestore!\n```{str(e)}```")
+        await ctx.send(f"❌ **Critical Error**: Failed to remove channel!\n```{str(e)}```")
         return
     
     guild_name = ctx.guild.name if ctx.guild else "DM"
@@ -567,40 +1772,161 @@ async def remove_channel(ctx):
     )
     await ctx.send(embed=embed)
 
+def shard_status_lines():
+    """One line per shard run by this process: latency, guilds and active channels."""
+    guild_counts = {}
+    for guild in bot.guilds:
+        guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+    channel_counts = {}
+    for guild_id, channel_ids in active_channels.guilds.items():
+        shard_id = shard_for_guild(guild_id)
+        channel_counts[shard_id] = channel_counts.get(shard_id, 0) + len(channel_ids)
+    
+    lines = []
+    for shard_id, shard in sorted(bot.shards.items()):
+        state = "🔴 closed" if shard.is_closed() else f"🟢 {shard.latency * 1000:.0f}ms"
+        lines.append(f"• Shard {shard_id}: {state}, {guild_counts.get(shard_id, 0)} servers, "
+                     f"{channel_counts.get(shard_id, 0)} active channels")
+    return lines
+
+def shard_summary():
+    """One line for all of this process's shards, so the header stays short however many there are."""
+    shards = list(bot.shards.values())
+    latencies = [shard.latency * 1000 for shard in shards if not shard.is_closed()]
+    closed = len(shards) - len(latencies)
+    summary = f"**Shards:** {len(latencies)} open, {closed} closed"
+    if latencies:
+        summary += f", latency {min(latencies):.0f}-{max(latencies):.0f}ms"
+    return summary
+
+STATUS_PAGE_SIZE = 15
+
+class PaginatedEmbedView(discord.ui.View):
+    """Previous/Next buttons over a list of embed lines, usable only by whoever ran the command."""
+    
+    def __init__(self, author_id, title, header, lines, color, page_size=STATUS_PAGE_SIZE):
+        super().__init__(timeout=180)
+        self.author_id = author_id
+        self.title = title
+        self.header = header
+        self.lines = lines
+        self.color = color
+        self.page_size = page_size
+        self.pages = max(1, -(-len(lines) // page_size))
+        self.page = 0
+        self.message = None
+        self.update_buttons()
+    
+    def embed(self):
+        # Only the current page is ever built, so this stays well under the 4096-character limit
+        start = self.page * self.page_size
+        embed = discord.Embed(
+            title=self.title,
+            description=self.header + "\n\n" + "\n".join(self.lines[start:start + self.page_size]),
+            color=self.color
+        )
+        if self.pages > 1:
+            embed.set_footer(text=f"Page {self.page + 1}/{self.pages}")
+        return embed
+    
+    def update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+    
+    async def send(self, ctx):
+        if self.pages == 1:
+            await ctx.send(embed=self.embed())
+        else:
+            self.message = await ctx.send(embed=self.embed(), view=self)
+    
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who ran this command can turn pages.", ephemeral=True)
+            return False
+        return True
+    
+    async def turn_page(self, interaction, step):
+        self.page = max(0, min(self.pages - 1, self.page + step))
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+    
+    @discord.ui.button(label='◀ Previous', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self.turn_page(interaction, -1)
+    
+    @discord.ui.button(label='Next ▶', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self.turn_page(interaction, 1)
+    
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
 @bot.command(name='status')
-async def status(ctx):
-    """Show the status of active channels."""
-    if not active_channels:
+async def status(ctx, scope: str = None):
+    """Show this server's active channels, or a per-server summary with `!status global`."""
+    if scope == 'global':
+        await global_status(ctx)
+        return
+    
+    # Only this server's channels, straight from the guild index - DMs only see their own channel
+    if ctx.guild:
+        channel_keys = active_channels.guild_channels(ctx.guild.id)
+        shard = bot.get_shard(ctx.guild.shard_id)
+        shard_line = f"**Shard:** {ctx.guild.shard_id} of {bot.shard_count} ({shard.latency * 1000:.0f}ms)\n" if shard else ""
+    else:
+        channel_keys = [(None, ctx.channel.id)] if (None, ctx.channel.id) in active_channels else []
+        shard_line = ""
+    
+    if not channel_keys:
         embed = discord.Embed(
             title="📊 Pinyin Bot Status",
-            description=f"No channels are currently active for pinyin functionality.\n\n"
-                       f"**Storage:** Firestore ☁️\n\n"
+            description=f"No channels are currently active for pinyin functionality here.\n\n"
+                       f"**Storage:** Firestore ☁️\n"
+                       f"{shard_line}\n"
                        f"Use `!init` in any channel to activate it!",
             color=0xffa500
         )
         await ctx.send(embed=embed)
         return
     
-    # Build status message
-    status_lines = []
-    for guild_id, channel_id in active_channels:
-        try:
-            guild = bot.get_guild(guild_id) if guild_id else None
-            channel = bot.get_channel(channel_id)
-            
-            guild_name = guild.name if guild else "DM"
-            channel_name = channel.name if channel and hasattr(channel, 'name') else f"Channel {channel_id}"
-            
-            status_lines.append(f"• **{guild_name}** - #{channel_name}")
-        except Exception as e:
-            status_lines.append(f"• Unknown Channel (ID: {channel_id})")
+    # Channel mentions render client-side, so no per-channel lookups are needed
+    status_lines = [f"• <#{channel_id}>" for _, channel_id in sorted(channel_keys)]
+    header = (f"**Storage:** Firestore ☁️\n"
+              f"**Translation Cache:** {translation_cache.summary()}\n"
+              f"{shard_line}\n"
+              f"**Active Channels ({len(channel_keys)}):**")
     
-    embed = discord.Embed(
-        title="📊 Pinyin Bot Status",
-        description=f"**Active Channels ({len(active_channels)}):**\n\n" + "\n".join(status_lines) + f"\n\n**Storage:** Firestore ☁️",
-        color=0x4CAF50
+    await PaginatedEmbedView(ctx.author.id, "📊 Pinyin Bot Status", header, status_lines, 0x4CAF50).send(ctx)
+
+async def global_status(ctx):
+    """Bot-owner-only channel counts per server across this process's shards."""
+    if not await bot.is_owner(ctx.author):
+        await ctx.send("❌ Only the bot owner can view the global status.")
+        return
+    
+    counts = sorted(
+        ((guild_id, len(channel_ids)) for guild_id, channel_ids in active_channels.guilds.items()),
+        key=lambda item: item[1],
+        reverse=True
     )
-    await ctx.send(embed=embed)
+    summary_lines = []
+    for guild_id, count in counts:
+        guild = bot.get_guild(guild_id) if guild_id else None
+        name = guild.name if guild else ("DMs" if guild_id is None else "Unknown server")
+        summary_lines.append(f"• **{name}** (`{guild_id}`): {count} channels")
+    
+    header = (f"**Active Channels:** {len(active_channels)} in {len(counts)} servers/DM groups\n"
+              f"**Servers:** {len(bot.guilds)}\n"
+              f"**Translation Cache:** {translation_cache.summary()}\n"
+              f"{shard_summary()}")
+    
+    # Per-shard detail is paginated with the servers - one line per shard would overflow the embed
+    lines = shard_status_lines() + summary_lines
+    await PaginatedEmbedView(ctx.author.id, "🌐 Pinyin Bot Global Status", header, lines, 0x4CAF50).send(ctx)
 
 @bot.command(name='backup')
 async def backup_channels(ctx):
@@ -631,6 +1957,53 @@ async def backup_channels(ctx):
         )
         await ctx.send(embed=embed)
 
+@bot.command(name='limits')
+async def limits_command(ctx, setting: str = None, value: float = None):
+    """Show or change this server's translation quotas."""
+    guild_id = ctx.guild.id if ctx.guild else None
+    settings = {
+        'guild': 'guild_lines_per_minute',
+        'user': 'user_lines_per_minute',
+        'weight': 'weight',
+    }
+    
+    if setting is not None:
+        is_owner = await bot.is_owner(ctx.author)
+        if ctx.guild is None or not (is_owner or ctx.author.guild_permissions.administrator):
+            await ctx.send("❌ You need administrator permissions to change limits.")
+            return
+        if setting not in settings or value is None or not math.isfinite(value) or value <= 0:
+            await ctx.send("❌ Usage: `!limits <guild|user|weight> <positive number>`")
+            return
+        
+        # Weights and above-default quotas take capacity from every other server
+        name = settings[setting]
+        if (name == 'weight' or value > LIMIT_DEFAULTS[name]) and not is_owner:
+            if name == 'weight':
+                await ctx.send("❌ Only the bot owner can change the scheduling weight.")
+            else:
+                await ctx.send(f"❌ Only the bot owner can raise this limit above the default of {LIMIT_DEFAULTS[name]:g} lines/minute.")
+            return
+        
+        admission.set_limit(guild_id, settings[setting], value)
+        try:
+            await admission.save(guild_id)
+        except Exception as e:
+            print(f"❌ Failed to save limits for guild {guild_id}: {e}")
+            await ctx.send(f"⚠️ Limit applied, but saving to Firestore failed:\n```{str(e)}```")
+            return
+    
+    embed = discord.Embed(
+        title="🚦 Translation Limits",
+        description=f"**Server:** {admission.guild_rate(guild_id):g} lines/minute\n"
+                   f"**Per user:** {admission.user_rate(guild_id):g} lines/minute\n"
+                   f"**Scheduling weight:** {admission.weight(guild_id):g}\n\n"
+                   f"Admins can lower the quotas with `!limits <guild|user> <value>`; "
+                   f"raising them or changing the weight needs the bot owner.",
+        color=0x3498db
+    )
+    await ctx.send(embed=embed)
+
 @bot.command(name='help')
 async def help_command(ctx):
     """Show help information."""
@@ -645,8 +2018,10 @@ async def help_command(ctx):
         name="📌 Setup Commands",
         value="`!init` - Initialize current channel for pinyin functionality\n"
               "`!remove` - Remove current channel from pinyin functionality\n"
-              "`!status` - Show all active channels\n"
-              "`!backup` - Create backup of active channels (Admin only)",
+              "`!status` - Show this server's active channels\n"
+              "`!status global` - Channel counts per server (Bot owner only)\n"
+              "`!backup` - Create backup of active channels (Admin only)\n"
+              "`!limits` - Show this server's translation quotas (Admins can change them)",
         inline=False
     )
     
@@ -695,83 +2070,248 @@ async def on_message(message):
     if channel_key not in active_channels:
         return
     
-    # Skip if message is empty or only whitespace
-    if not message.content.strip():
+    # Skip if message contains no Chinese characters
+    if not has_chinese_content(message.content):
         return
     
-    # Check if message contains Chinese characters
-    if not has_chinese_content(message.content):
+    # Split message by lines and keep the ones with Chinese, checking each line once
+    lines = [line.strip() for line in message.content.strip().split('\n')]
+    chinese_lines = [line for line in lines if has_chinese_content(line)]
+    
+    # Enforce per-user and per-guild quotas before queueing
+    limited = admission.check(message, len(chinese_lines))
+    if limited:
+        key = (guild_id, message.author.id) if limited == 'user' else guild_id
+        print(f"🐢 {limited.title()} quota exceeded for guild {guild_id}, user {message.author.id}")
+        if QUEUE_OVERFLOW == 'reply' and admission.should_notify(key):
+            who = "You're" if limited == 'user' else "This server is"
+            await message.reply(f"🐢 {who} sending lines faster than I can keep up with - please slow down a little.")
         return
     
+    # Hand off to the job queue; workers do the translation and rendering
+    placeholders = asyncio.get_running_loop().create_future() if PROGRESSIVE_REPLIES else None
+    if not pinyin_queue.submit(message, chinese_lines, placeholders):
+        if QUEUE_OVERFLOW == 'reply':
+            await message.reply("⏳ I'm busy right now - please try again in a moment.")
+        return
+    
+    # Only work that was actually queued counts against the quotas
+    admission.charge(message, len(chinese_lines))
+    
+    if placeholders is not None:
+        await send_placeholders(message, chinese_lines, placeholders)
+
+def pinyin_preview(line):
+    """Text reply shown while the image is being made - pinyin is local and takes milliseconds."""
+    pinyin_line = text_to_pinyin(line)
+    preview = f"{pinyin_line}\n**{line}**"
+    if len(preview) > 1900:
+        preview = preview[:1900] + "…"
+    return f"{preview}\n-# {PROGRESS_NOTE}"
+
+async def send_placeholders(message, chinese_lines, placeholders):
+    """Reply with each line's pinyin and hand the replies to the worker that will edit them."""
+    replies = []
+    try:
+        for line in chinese_lines:
+            with STAGE_SECONDS.labels('placeholder').time():
+                replies.append(await message.reply(pinyin_preview(line)))
+    except Exception as e:
+        ERRORS.labels('placeholder').inc()
+        print(f"Error sending pinyin placeholder: {e}")
+    
+    # Lines without a placeholder get a normal reply from the worker
+    placeholders.set_result(replies + [None] * (len(chinese_lines) - len(replies)))
+
+
+async def process_pinyin_job(message, chinese_lines, placeholders=None):
+    """Translate, render and reply for the Chinese lines of one message.
+    
+    With placeholders (a future of pinyin replies from send_placeholders),
+    each reply is edited to carry the image instead of sending a new one.
+    """
+    finished = 0
     try:
-        # Split message by lines and process each line separately
-        lines = [line.strip() for line in message.content.strip().split('\n') if line.strip()]
+        # Translate every Chinese line of the message in one request
+        translation = asyncio.ensure_future(translate_lines(chinese_lines))
+        timed_out = False
+        
+        if placeholders is None:
+            translations = dict(zip(chinese_lines, await translation))
+        else:
+            try:
+                # Shielded so a late translation still reaches the cache for next time
+                translations = dict(zip(chinese_lines, await asyncio.wait_for(
+                    asyncio.shield(translation), PROGRESSIVE_TRANSLATION_TIMEOUT
+                )))
+            except asyncio.TimeoutError:
+                print(f"⌛ Translation took over {PROGRESSIVE_TRANSLATION_TIMEOUT}s, sending images without it")
+                ERRORS.labels('translation_timeout').inc()
+                translations = {line: "" for line in chinese_lines}
+                timed_out = True
         
-        for line in lines:
-            if has_chinese_content(line):
-                # Create image for this line
-                image_buffer = create_image(line)
+        replies = await placeholders if placeholders is not None else [None] * len(chinese_lines)
+        
+        for line, reply in zip(chinese_lines, replies):
+            # Render in the pool with the batched translation
+            image_buffer = await render_image(line, translations[line])
+            
+            if image_buffer:
+                # Convert buffer to discord.File
+                file = discord.File(image_buffer, filename=image_filename())
                 
-                if image_buffer:
-                    # Convert buffer to discord.File
-                    file = discord.File(image_buffer, filename='pinyin_translation.png')
-                    
-                    # Create view with button
-                    view = AudioButtonView()
+                # Create view with a persistent button keyed to this line
+                view = AudioButtonView(await audio_text_store.put(line))
 
-                    # Reply to the original message with the image and button
-                    await message.reply(file=file, view=view)
-                    
-                    # Small delay between images to avoid rate limiting
-                    if len(lines) > 1:
-                        await asyncio.sleep(0.5)
-                else:
-                    await message.reply(f"Sorry, couldn't process: {line}")
+                with STAGE_SECONDS.labels('upload').time():
+                    if reply is not None:
+                        # Swap the pinyin placeholder for the finished image
+                        await reply.edit(content="-# ⚠️ Translation timed out" if timed_out else None,
+                                         attachments=[file], view=view)
+                    else:
+                        # Reply to the original message with the image and button
+                        await message.reply(file=file, view=view)
+                LINES_PROCESSED.inc()
                 
+                # Optional spacing between images of a multi-line message
+                if reply is None and len(chinese_lines) > 1 and REPLY_DELAY > 0:
+                    await asyncio.sleep(REPLY_DELAY)
+            elif reply is not None:
+                await reply.edit(content=f"Sorry, couldn't process: {line}")
+            else:
+                await message.reply(f"Sorry, couldn't process: {line}")
+            finished += 1
+        
+        MESSAGES_PROCESSED.inc()
+            
     except Exception as e:
+        ERRORS.labels('message').inc()
         print(f"Error processing message: {e}")
-        await message.reply("Sorry, there was an error processing your message.")
+        await report_job_failure(message, placeholders, finished)
+
+async def report_job_failure(message, placeholders, finished):
+    """Tell the user a job failed, marking placeholders that never got their image."""
+    try:
+        replies = await placeholders if placeholders is not None else []
+        pending = [reply for reply in replies[finished:] if reply is not None]
+        
+        # Otherwise they would say "Translating and drawing..." forever
+        for reply in pending:
+            await reply.edit(content=reply.content.replace(PROGRESS_NOTE, FAILURE_NOTE))
+        
+        if not pending:
+            await message.reply("Sorry, there was an error processing your message.")
+    except Exception as e:
+        print(f"Error reporting failed message: {e}")
+
+
+class AudioTextStore:
+    """Maps short keys carried in button custom_ids to the text they should speak.
+    
+    SQLite work runs on a dedicated thread, like TranslationCache. Rows are
+    bounded by age and count; a button whose key was evicted falls back to
+    the text embedded in its image.
+    """
+    
+    def __init__(self, path, max_entries=100000, ttl=90 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.writes = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-texts')
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS audio_texts (key TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_audio_texts_created ON audio_texts (created_at)')
+        self.conn.commit()
+    
+    @staticmethod
+    def key_for(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+    
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    async def put(self, text):
+        key = self.key_for(text)
+        await self._run(self._write, key, text, time.time())
+        return key
+    
+    async def get(self, key):
+        return await self._run(self._read, key)
+    
+    def _write(self, key, text, now):
+        # Re-posting a line refreshes its age, so buttons in active use aren't evicted
+        self.conn.execute(
+            'INSERT OR REPLACE INTO audio_texts (key, text, created_at) VALUES (?, ?, ?)', (key, text, now)
+        )
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self._evict(now)
+        self.conn.commit()
+    
+    def _read(self, key):
+        row = self.conn.execute('SELECT text FROM audio_texts WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+    
+    def _evict(self, now):
+        # Drop expired rows, then the oldest rows over the size limit
+        self.conn.execute('DELETE FROM audio_texts WHERE created_at < ?', (now - self.ttl,))
+        self.conn.execute(
+            'DELETE FROM audio_texts WHERE key IN ('
+            'SELECT key FROM audio_texts ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+audio_text_store = AudioTextStore(
+    os.path.join(CACHE_DIR, 'audio_texts.db'),
+    max_entries=int(os.getenv('AUDIO_TEXT_STORE_SIZE', '100000')),
+    ttl=int(os.getenv('AUDIO_TEXT_STORE_TTL', str(90 * 24 * 3600)))
+)
+
+
+class AudioButton(discord.ui.DynamicItem[discord.ui.Button], template=r'pinyin_audio:(?P<key>[0-9a-f]{16})'):
+    """Play Audio button whose custom_id carries the text key, so it keeps working after restarts."""
+    
+    def __init__(self, text_key):
+        super().__init__(
+            discord.ui.Button(
+                label='🔊 Play Audio',
+                style=discord.ButtonStyle.primary,
+                custom_id=f'pinyin_audio:{text_key}'
+            )
+        )
+        self.text_key = text_key
+    
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['key'])
+    
+    async def callback(self, interaction):
+        await AudioButtonView.play_audio(interaction, self.text_key)
 
 
 class AudioButtonView(discord.ui.View):
-    def __init__(self):
-        super().__init__(timeout=None)  # No timeout since we're reading from image
+    def __init__(self, text_key):
+        super().__init__(timeout=None)  # No timeout - the button is persistent
+        self.add_item(AudioButton(text_key))
     
-    @discord.ui.button(label='🔊 Play Audio', style=discord.ButtonStyle.primary)
-    async def play_audio(self, interaction: discord.Interaction, button: discord.ui.Button):
+    @staticmethod
+    async def play_audio(interaction: discord.Interaction, text_key: str):
         await interaction.response.defer()
         
         try:
-            # Get the message that contains this view (the bot's reply with the image)
-            message = interaction.message
-            
-            # Check if message has attachments
-            if not message.attachments:
-                await interaction.followup.send("No image found to extract text from.", ephemeral=True)
-                return
-            
-            # Get the first attachment (should be our PNG image)
-            attachment = message.attachments[0]
-            
-            # Download the image bytes
-            image_bytes = await attachment.read()
+            # Look up the text by the key from the button's custom_id
+            chinese_text = await audio_text_store.get(text_key)
             
-            # Extract Chinese text from PNG metadata
-            try:
-                img = Image.open(io.BytesIO(image_bytes))
-                chinese_text = img.info.get('chinese_text', '')
-                
+            if not chinese_text:
+                # Key store was lost (e.g. non-persistent cache dir) - read the image metadata instead
+                chinese_text = await AudioButtonView.read_image_text(interaction)
                 if not chinese_text:
-                    await interaction.followup.send("Could not find Chinese text in image metadata.", ephemeral=True)
                     return
-                
-            except Exception as e:
-                print(f"Error reading image metadata: {e}")
-                await interaction.followup.send("Could not read image metadata.", ephemeral=True)
-                return
             
-            # Generate audio using the extracted Chinese text
-            audio_path = create_audio(chinese_text)
+            # Generate audio using the Chinese text (served from the audio cache when possible)
+            audio_path = await create_audio(chinese_text)
             
             if audio_path:
                 try:
@@ -780,9 +2320,6 @@ class AudioButtonView(discord.ui.View):
                         discord_file = discord.File(audio_file, filename='chinese_audio.mp3')
                         await interaction.followup.send(file=discord_file)
                     
-                    # Clean up temporary file
-                    os.unlink(audio_path)
-                    
                 except Exception as e:
                     await interaction.followup.send("Sorry, couldn't generate audio.", ephemeral=True)
             else:
@@ -791,32 +2328,162 @@ class AudioButtonView(discord.ui.View):
         except Exception as e:
             print(f"Error in play_audio: {e}")
             await interaction.followup.send("Sorry, there was an error generating audio.", ephemeral=True)
+    
+    @staticmethod
+    async def read_image_text(interaction: discord.Interaction):
+        """Fallback: download the reply's image and read the chinese_text PNG metadata."""
+        # Get the message that contains this view (the bot's reply with the image)
+        message = interaction.message
+        
+        # Check if message has attachments
+        if not message.attachments:
+            await interaction.followup.send("No image found to extract text from.", ephemeral=True)
+            return None
+        
+        # Get the first attachment (should be our PNG image)
+        attachment = message.attachments[0]
+        
+        # Download the image bytes
+        image_bytes = await attachment.read()
+        
+        # Extract Chinese text from PNG metadata
+        try:
+            img = Image.open(io.BytesIO(image_bytes))
+            chinese_text = img.info.get('chinese_text', '')
+            if not chinese_text and EXIF_IMAGE_DESCRIPTION in img.getexif():
+                chinese_text = json.loads(img.getexif()[EXIF_IMAGE_DESCRIPTION])
+            
+            if not chinese_text:
+                await interaction.followup.send("Could not find Chinese text in image metadata.", ephemeral=True)
+                return None
+            
+            return chinese_text
+            
+        except Exception as e:
+            print(f"Error reading image metadata: {e}")
+            await interaction.followup.send("Could not read image metadata.", ephemeral=True)
+            return None
 
 
-def create_audio(text):
+class AudioCache:
+    """Content-addressed MP3 cache on disk with LRU size eviction and in-flight de-duplication."""
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # hash -> file size, least recently used first
+        self.total_bytes = 0
+        self.in_flight = {}  # hash -> asyncio.Future shared by concurrent requests
+        self.stats = {'hits': 0, 'misses': 0, 'shared': 0, 'evictions': 0}
+        
+        os.makedirs(directory, exist_ok=True)
+        
+        # Index files left by previous runs, oldest access first
+        existing = []
+        for name in os.listdir(directory):
+            if name.endswith('.mp3'):
+                stat = os.stat(os.path.join(directory, name))
+                existing.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(existing):
+            self.entries[key] = size
+            self.total_bytes += size
+    
+    @staticmethod
+    def key_for(chinese_only):
+        return hashlib.sha256(chinese_only.encode('utf-8')).hexdigest()
+    
+    def path_for(self, key):
+        return os.path.join(self.directory, f'{key}.mp3')
+    
+    async def get(self, chinese_only, synthesize):
+        """Return the cached MP3 path for the text, calling synthesize(text, path) once on a miss."""
+        key = self.key_for(chinese_only)
+        path = self.path_for(key)
+        
+        if key in self.entries and os.path.exists(path):
+            self.entries.move_to_end(key)
+            os.utime(path)
+            self.stats['hits'] += 1
+            CACHE_LOOKUPS.labels('audio', 'hit').inc()
+            return path
+        
+        # Another click is already synthesizing this text - share its result
+        if key in self.in_flight:
+            self.stats['shared'] += 1
+            CACHE_LOOKUPS.labels('audio', 'shared').inc()
+            return await asyncio.shield(self.in_flight[key])
+        
+        self.stats['misses'] += 1
+        CACHE_LOOKUPS.labels('audio', 'miss').inc()
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        
+        # Write to a temp name and rename so readers never see a partial file
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        
+        try:
+            await asyncio.to_thread(synthesize, chinese_only, temp_path)
+            os.replace(temp_path, path)
+            
+            self._add(key, os.path.getsize(path))
+            future.set_result(path)
+            return path
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            future.set_exception(e)
+            # Mark retrieved so an unshared failure doesn't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+    
+    def _add(self, key, size):
+        # A re-added key replaces its old file, so only the difference counts
+        self.total_bytes += size - self.entries.pop(key, 0)
+        self.entries[key] = size
+        
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            old_key, old_size = self.entries.popitem(last=False)
+            self.total_bytes -= old_size
+            self.stats['evictions'] += 1
+            try:
+                os.unlink(self.path_for(old_key))
+            except FileNotFoundError:
+                pass
+
+audio_cache = AudioCache(
+    os.path.join(CACHE_DIR, 'audio'),
+    max_bytes=int(os.getenv('AUDIO_CACHE_MAX_MB', '200')) * 1024 * 1024
+)
+
+def synthesize_audio(chinese_only, path):
+    """Run gTTS for the text and save the MP3 to path."""
+    from gtts import gTTS
+    
+    with STAGE_SECONDS.labels('tts').time():
+        tts = gTTS(text=chinese_only, lang='zh-cn', slow=False)
+        tts.save(path)
+
+async def create_audio(text):
     """Create audio file for Chinese text."""
     try:
         # Extract only Chinese characters for TTS
-        chinese_only = ''.join(char for char in text if is_chinese_char(char))
+        chinese_only = ''.join(CHINESE_RE.findall(text))
         
         if not chinese_only:
             return None
-            
-        # Create TTS audio
-        tts = gTTS(text=chinese_only, lang='zh-cn', slow=False)
         
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-            tts.save(temp_file.name)
-            return temp_file.name
+        return await audio_cache.get(chinese_only, synthesize_audio)
             
     except Exception as e:
+        ERRORS.labels('tts').inc()
         print(f"Error creating audio: {e}")
         return None
 
 
 def run_flask():
-    app.run(host='0.0.0.0', port=7860)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '7860')))
 
 def run_bot():
     # Get Discord token from environment variable
@@ -832,6 +2499,11 @@ Please set your Discord bot token in the environment variables.
         print(error_msg)
         raise Exception("DISCORD_TOKEN environment variable not set!")
     
+    if SHARD_IDS is not None and SHARD_COUNT is None:
+        raise Exception("SHARD_IDS requires SHARD_COUNT to be set!")
+    if SHARD_IDS is not None and SHARD_IDS[-1] >= SHARD_COUNT:
+        raise Exception(f"SHARD_IDS {SHARD_IDS} out of range for SHARD_COUNT={SHARD_COUNT}!")
+    
     max_retries = 5
     retry_delay = 10
 
@@ -851,6 +2523,8 @@ Please set your Discord bot token in the environment variables.
         except Exception as e:
             print(f"❌ CRITICAL ERROR running bot: {e}")
             raise e
+        finally:
+            shutdown_render_executor()
     
 
     anthropic_key = os.getenv('ANTHROPIC_API_KEY')
@@ -868,6 +2542,9 @@ Please set your Discord bot token in the environment variables.
 if __name__ == "__main__":
     print("🔥 Starting Chinese Pinyin Discord Bot (Firestore Required)")
     
+    # Initialize Firestore - REQUIRED
+    connect_firestore()
+    
     # Start Flask server in a separate thread for Hugging Face Spaces health check
     flask_thread = threading.Thread(target=run_flask, daemon=True)
     flask_thread.start()
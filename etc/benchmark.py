@@ -0,0 +1,266 @@
+"""Offline benchmark for the text and render pipeline.
+
+Runs tokenize, pinyin, translation, render, encode, create_image and TTS
+against a fixed corpus with translation and gTTS stubbed out, so no Discord
+connection, Firestore or API keys are needed. Results are printed and saved
+as JSON so runs from different commits can be compared.
+
+Run from the repository root:
+    python etc/benchmark.py --output bench.json
+    python etc/benchmark.py --compare bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+# Keep caches out of the real cache directory
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='pinyin_bench_'))
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_ROOT)
+
+import app
+
+
+CORPUS = {
+    'short': [
+        '你好',
+        '谢谢你！',
+        '我很好，你呢？',
+        '今天天气怎么样？',
+        '我们一起去吃饭吧。',
+        '明天见！',
+    ],
+    'long': [
+        '学而时习之，不亦说乎？有朋自远方来，不亦乐乎？人不知而不愠，不亦君子乎？',
+        '我在北京语言大学学习汉语已经两年了，每天早上八点上课，下午在图书馆复习生词和语法。',
+        '随着科技的发展，越来越多的人开始在网上学习外语，这种方式既方便又灵活，但也需要很强的自律能力。',
+    ],
+    'mixed': [
+        '我今天用 Python 写了一个 Discord bot',
+        'Meeting 改到 3:30 了，别忘了带 laptop',
+        '这个 API 的 latency 太高了，需要加 cache',
+        'I love 北京烤鸭 and 小笼包!',
+    ],
+    'punctuation': [
+        '“你好！”他说：“你吃了吗？”',
+        '——啊？！……真的吗？？？',
+        '《红楼梦》、《西游记》、《水浒传》和《三国演义》。',
+        '（注意：第1、2、3题必做；第4题选做。）',
+    ],
+}
+
+ALL_LINES = [line for lines in CORPUS.values() for line in lines]
+FAKE_TRANSLATION = 'これはベンチマーク用のダミー翻訳です'
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples, peak_bytes):
+    total = sum(samples)
+    return {
+        'calls': len(samples),
+        'total_s': total,
+        'throughput_per_s': len(samples) / total if total else 0,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples) * 1000,
+        'peak_kib': peak_bytes / 1024,
+    }
+
+
+def measure(func, inputs, iterations):
+    """Time func over every input, then rerun one pass under tracemalloc for peak memory."""
+    samples = []
+    for _ in range(iterations):
+        for item in inputs:
+            started = time.perf_counter()
+            func(item)
+            samples.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    for item in inputs:
+        func(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return summarize(samples, peak)
+
+
+def install_tts_stub(tts_latency):
+    """Replace gTTS with a local stand-in that writes a small fake MP3."""
+    def fake_synthesize_audio(chinese_only, path):
+        time.sleep(tts_latency)
+        with open(path, 'wb') as f:
+            f.write(b'\xff\xfb' + chinese_only.encode('utf-8') * 64)
+
+    app.synthesize_audio = fake_synthesize_audio
+
+
+def install_stubs(translation_latency, tts_latency):
+    """Replace the network calls with local stand-ins."""
+    async def fake_request_translation(text):
+        await asyncio.sleep(translation_latency)
+        return FAKE_TRANSLATION
+
+    async def fake_request_batch_translation(lines):
+        await asyncio.sleep(translation_latency)
+        return [FAKE_TRANSLATION] * len(lines)
+
+    app.request_translation = fake_request_translation
+    app.request_batch_translation = fake_request_batch_translation
+    install_tts_stub(tts_latency)
+
+
+def prepared_lines(line):
+    return app.text_to_pinyin(line), line, FAKE_TRANSLATION
+
+
+def run_stages(args):
+    loop = asyncio.new_event_loop()
+    results = {}
+    selected = set(args.stages.split(',')) if args.stages else None
+
+    def wanted(name):
+        return selected is None or name in selected or name.split(':')[0] in selected
+
+    if wanted('tokenize'):
+        results['tokenize'] = measure(lambda line: list(app.tokenize_spans(line)), ALL_LINES, args.iterations)
+
+    # Same split as create_image: spans once, then pinyin from the spans
+    spans = [(line, list(app.tokenize_spans(line))) for line in ALL_LINES]
+    if wanted('pinyin'):
+        def pinyin_cold(item):
+            app.segment_to_pinyin.cache_clear()
+            app.spans_to_pinyin(*item)
+        results['pinyin:cold'] = measure(pinyin_cold, spans, args.iterations)
+        for item in spans:
+            app.spans_to_pinyin(*item)
+        results['pinyin:warm'] = measure(lambda item: app.spans_to_pinyin(*item), spans, args.iterations)
+
+    if wanted('translation'):
+        # One message per corpus group, with a fresh cache so every run starts cold
+        def translate(lines):
+            app.translation_cache.memory.clear()
+            app.translation_cache.conn.execute('DELETE FROM translations')
+            loop.run_until_complete(app.translate_lines(lines))
+        results['translation:batched'] = measure(translate, list(CORPUS.values()), args.iterations)
+        results['translation:cached'] = measure(
+            lambda lines: loop.run_until_complete(app.translate_lines(lines)), list(CORPUS.values()), args.iterations
+        )
+
+    texts = [prepared_lines(line) for line in ALL_LINES]
+    if wanted('render'):
+        app.load_matplotlib()
+        results['render:matplotlib'] = measure(lambda t: app.draw_figure(*t), texts, args.iterations)
+        results['render:pillow'] = measure(lambda t: app.draw_pillow(*t), texts, args.iterations)
+
+    if wanted('encode'):
+        images = [app.draw_pillow(*t) for t in texts]
+        for image_format in ('png', 'png-palette', 'webp'):
+            app.IMAGE_FORMAT = image_format
+            sizes = [len(app.encode_image(image, 'x').getvalue()) for image in images]
+            stats = measure(lambda image: app.encode_image(image, 'x'), images, args.iterations)
+            stats['mean_bytes'] = sum(sizes) / len(sizes)
+            results[f'encode:{image_format}'] = stats
+        app.IMAGE_FORMAT = 'png'
+
+    if wanted('create_image'):
+        for backend in ('matplotlib', 'pillow'):
+            app.RENDER_BACKEND = backend
+            results[f'create_image:{backend}'] = measure(
+                lambda line: app.create_image(line, FAKE_TRANSLATION), ALL_LINES, args.iterations
+            )
+
+    if wanted('tts'):
+        def tts_miss(line):
+            for key in list(app.audio_cache.entries):
+                os.unlink(app.audio_cache.path_for(key))
+            app.audio_cache.entries.clear()
+            app.audio_cache.total_bytes = 0
+            loop.run_until_complete(app.create_audio(line))
+        results['tts:miss'] = measure(tts_miss, ALL_LINES, args.iterations)
+        for line in ALL_LINES:
+            loop.run_until_complete(app.create_audio(line))
+        results['tts:hit'] = measure(lambda line: loop.run_until_complete(app.create_audio(line)), ALL_LINES, args.iterations)
+
+    loop.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results, baseline=None):
+    print(f"{'stage':24} {'calls':>6} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KiB':>9}")
+    for name, stats in results.items():
+        line = (f"{name:24} {stats['calls']:6} {stats['throughput_per_s']:10.1f} {stats['p50_ms']:9.3f} "
+                f"{stats['p95_ms']:9.3f} {stats['p99_ms']:9.3f} {stats['peak_kib']:9.0f}")
+        if 'mean_bytes' in stats:
+            line += f"  {stats['mean_bytes'] / 1024:.1f} KiB/image"
+        if baseline and name in baseline:
+            old = baseline[name]['p50_ms']
+            line += f"  (p50 {((stats['p50_ms'] - old) / old * 100) if old else 0:+.0f}% vs baseline)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5, help='passes over the corpus per stage')
+    parser.add_argument('--stages', help='comma-separated stages: tokenize,pinyin,translation,render,encode,create_image,tts')
+    parser.add_argument('--translation-latency', type=float, default=0.0, help='seconds of fake Claude latency')
+    parser.add_argument('--tts-latency', type=float, default=0.0, help='seconds of fake gTTS latency')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='JSON file from a previous run to compare against')
+    args = parser.parse_args()
+
+    install_stubs(args.translation_latency, args.tts_latency)
+    
+    # Missing-glyph warnings would otherwise bury the report on machines without the CJK fonts
+    warnings.filterwarnings('ignore', message='Glyph')
+    
+    # The pipeline logs every image and cache hit; keep the report readable
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = run_stages(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['stages']
+    print_results(results, baseline)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'iterations': args.iterations,
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'stages': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Saved results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,554 @@
+"""End-to-end load test for the message and audio handlers.
+
+Drives the real on_message and AudioButtonView.play_audio handlers with fake
+Discord messages and interactions at increasing offered load. Firestore,
+Claude, gTTS and the Discord API are replaced by local stand-ins with
+configurable latency, so it runs offline. Each step reports end-to-end
+latency (message received -> last image reply, click -> audio sent) and
+event-loop lag.
+Claude is faked at the client level, so the real request functions, the
+shared concurrency semaphore and ANTHROPIC_TIMEOUT are all exercised.
+First-reply latency is what users perceive: with progressive replies it is
+the pinyin placeholder, otherwise the first image.
+
+Run from the repository root:
+    python etc/loadtest.py --rates 1,2,5,10 --duration 20
+    python etc/loadtest.py --anthropic-latency 1.5 --click-ratio 0.3 --output load.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import threading
+import warnings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', default='1,2,5,10', help='comma-separated offered loads in messages/second')
+    parser.add_argument('--duration', type=float, default=15, help='seconds of traffic per step')
+    parser.add_argument('--drain-timeout', type=float, default=60, help='seconds to wait for in-flight work after each step')
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--channels-per-guild', type=int, default=2)
+    parser.add_argument('--users-per-guild', type=int, default=20)
+    parser.add_argument('--max-lines', type=int, default=3, help='Chinese lines per message, chosen uniformly from 1..N')
+    parser.add_argument('--click-ratio', type=float, default=0.2, help='fraction of image replies whose audio button gets clicked')
+    parser.add_argument('--repeat', action='store_true', help='reuse corpus lines verbatim so translation/audio caches hit')
+    parser.add_argument('--anthropic-latency', type=float, default=0.8, help='seconds per fake Claude request')
+    parser.add_argument('--tts-latency', type=float, default=0.5, help='seconds per fake gTTS request')
+    parser.add_argument('--firestore-latency', type=float, default=0.05, help='seconds per fake Firestore call')
+    parser.add_argument('--discord-latency', type=float, default=0.15, help='seconds per fake Discord API call')
+    parser.add_argument('--classic-replies', action='store_true', help='disable progressive replies (one image reply per line)')
+    parser.add_argument('--quotas', action='store_true', help='keep the default per-guild/user quotas instead of disabling them')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# Configure the bot before it is imported
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='pinyin_load_'))
+os.environ.setdefault('REPLY_DELAY', '0')
+os.environ.setdefault('CHANNEL_FLUSH_INTERVAL', '1')
+if args.classic_replies:
+    os.environ['PROGRESSIVE_REPLIES'] = 'false'
+if not args.quotas:
+    os.environ.setdefault('GUILD_LINES_PER_MINUTE', '1000000')
+    os.environ.setdefault('USER_LINES_PER_MINUTE', '1000000')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import CORPUS, FAKE_TRANSLATION, percentile, git_commit, install_tts_stub
+import app
+
+
+# --- Anthropic stand-in ---
+
+class FakeContentBlock:
+    def __init__(self, text):
+        self.text = text
+
+class FakeResponse:
+    def __init__(self, text):
+        self.content = [FakeContentBlock(text)]
+
+class FakeMessages:
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, model, max_tokens, messages, timeout=None):
+        return await self.client.respond(messages[-1]['content'], timeout)
+
+class FakeAnthropic:
+    """AsyncAnthropic stand-in: every request takes `latency` seconds and honours its timeout."""
+
+    BATCH_MARKER = 'no explanations: '
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.messages = FakeMessages(self)
+        self.calls = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def respond(self, prompt, timeout):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.wait_for(asyncio.sleep(self.latency), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+        if 'JSON array' in prompt:
+            lines = json.loads(prompt[prompt.index(self.BATCH_MARKER) + len(self.BATCH_MARKER):])
+            return FakeResponse(json.dumps([FAKE_TRANSLATION] * len(lines), ensure_ascii=False))
+        return FakeResponse(FAKE_TRANSLATION)
+
+    async def close(self):
+        pass
+
+
+# --- Firestore stand-in ---
+
+class FakeDocument:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self.data) if self.data is not None else None
+
+class FakeDocumentRef:
+    def __init__(self, store, collection, doc_id):
+        self.store = store
+        self.key = (collection, doc_id)
+
+    def set(self, data):
+        self.store.call()
+        self.store.docs[self.key] = dict(data)
+
+    def delete(self):
+        self.store.call()
+        self.store.docs.pop(self.key, None)
+
+    def get(self, timeout=None):
+        self.store.call()
+        return FakeDocument(self.key[1], self.store.docs.get(self.key))
+
+class FakeCollection:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def document(self, doc_id):
+        return FakeDocumentRef(self.store, self.name, doc_id)
+
+    def stream(self, timeout=None):
+        self.store.call()
+        return [FakeDocument(doc_id, data) for (name, doc_id), data in list(self.store.docs.items()) if name == self.name]
+
+class FakeBatch:
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref.key, dict(data)))
+
+    def delete(self, ref):
+        self.writes.append((ref.key, None))
+
+    def commit(self):
+        self.store.call()
+        for key, data in self.writes:
+            if data is None:
+                self.store.docs.pop(key, None)
+            else:
+                self.store.docs[key] = data
+
+class FakeFirestore:
+    """In-memory Firestore client; every round trip blocks for `latency` like the real one."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.docs = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def call(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+# --- Discord stand-ins ---
+
+class FakeUser:
+    def __init__(self, user_id, bot=False):
+        self.id = user_id
+        self.bot = bot
+        self.name = f'user{user_id}'
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+class FakeAttachment:
+    def __init__(self, data):
+        self.data = data
+
+    async def read(self):
+        return self.data
+
+class FakeMessage:
+    """Incoming user message. Replies are timed and handed to the harness."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, harness, content, author, guild, channel):
+        self.harness = harness
+        self.id = next(self.ids)
+        self.content = content
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.attachments = []
+        self.reply_to = None
+        self._state = app.bot._connection
+
+    async def reply(self, content=None, file=None, view=None):
+        await asyncio.sleep(args.discord_latency)
+        reply = FakeMessage(self.harness, content or '', app.bot.user, self.guild, self.channel)
+        reply.reply_to = self
+        if file is not None:
+            reply.attachments = [FakeAttachment(file.fp.read())]
+        self.harness.on_reply(self, reply, content, view)
+        return reply
+
+    async def edit(self, content=None, attachments=None, view=None):
+        await asyncio.sleep(args.discord_latency)
+        self.content = content or ''
+        if attachments is not None:
+            self.attachments = [FakeAttachment(file.fp.read()) for file in attachments]
+        self.harness.on_reply(self.reply_to, self, content, view)
+        return self
+
+class FakeInteractionResponse:
+    async def defer(self):
+        await asyncio.sleep(args.discord_latency)
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, file=None, ephemeral=False):
+        await asyncio.sleep(args.discord_latency)
+        self.interaction.harness.on_audio_sent(self.interaction, ok=file is not None)
+
+class FakeInteraction:
+    def __init__(self, harness, message, user):
+        self.harness = harness
+        self.message = message
+        self.user = user
+        self.response = FakeInteractionResponse()
+        self.followup = FakeFollowup(self)
+        self.created = time.perf_counter()
+
+
+# --- Load generator ---
+
+class Step:
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = time.perf_counter()
+        self.sent = 0
+        self.completed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.translation_failures = 0
+        self.latencies = []
+        self.first_latencies = []
+        self.audio_latencies = []
+        self.audio_errors = 0
+        self.loop_lag = []
+        self.max_queue_depth = 0
+        self.last_completion = self.started
+
+    def report(self, timeouts, audio_timeouts):
+        def ms(samples, fraction):
+            return percentile(samples, fraction) * 1000 if samples else None
+
+        elapsed = max(self.last_completion - self.started, 1e-9)
+        return {
+            'offered_per_s': self.rate,
+            'sent': self.sent,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'translation_failures': self.translation_failures,
+            'timeouts': timeouts,
+            'throughput_per_s': self.completed / elapsed,
+            'latency_p50_ms': ms(self.latencies, 0.50),
+            'latency_p95_ms': ms(self.latencies, 0.95),
+            'latency_p99_ms': ms(self.latencies, 0.99),
+            'latency_max_ms': max(self.latencies) * 1000 if self.latencies else None,
+            'first_reply_p50_ms': ms(self.first_latencies, 0.50),
+            'first_reply_p95_ms': ms(self.first_latencies, 0.95),
+            'audio_clicks': len(self.audio_latencies) + self.audio_errors + audio_timeouts,
+            'audio_p50_ms': ms(self.audio_latencies, 0.50),
+            'audio_p99_ms': ms(self.audio_latencies, 0.99),
+            'audio_errors': self.audio_errors + audio_timeouts,
+            'loop_lag_p50_ms': ms(self.loop_lag, 0.50),
+            'loop_lag_p99_ms': ms(self.loop_lag, 0.99),
+            'loop_lag_max_ms': max(self.loop_lag) * 1000 if self.loop_lag else None,
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+class LoadHarness:
+    def __init__(self):
+        self.random = random.Random(args.seed)
+        self.lines = [line for lines in CORPUS.values() for line in lines]
+        self.counter = itertools.count()
+        self.guilds = [FakeGuild(1000 + g) for g in range(args.guilds)]
+        self.channels = {
+            guild.id: [FakeChannel(guild.id * 100 + c) for c in range(args.channels_per_guild)]
+            for guild in self.guilds
+        }
+        self.users = {
+            guild.id: [FakeUser(guild.id * 1000 + u) for u in range(args.users_per_guild)]
+            for guild in self.guilds
+        }
+        self.pending = {}  # message id -> (step, sent_at, lines still to reply)
+        self.first_replied = set()  # message ids that got any reply yet
+        self.clicks = {}  # interaction -> step
+        self.tasks = set()
+        self.step = None
+
+    def spawn(self, coro):
+        # Keep a reference so tasks aren't garbage collected mid-flight
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def make_message(self):
+        guild = self.random.choice(self.guilds)
+        lines = []
+        for _ in range(self.random.randint(1, args.max_lines)):
+            line = self.random.choice(self.lines)
+            if not args.repeat:
+                # A numeric suffix keeps the line Chinese but defeats the caches
+                line = f'{line} {next(self.counter)}'
+            lines.append(line)
+        message = FakeMessage(
+            self, '\n'.join(lines),
+            self.random.choice(self.users[guild.id]), guild, self.random.choice(self.channels[guild.id])
+        )
+        return message, len(lines)
+
+    def count_translation_failures(self):
+        """Wrap translate_lines so lines that fell back to "Translation failed" count as errors.
+        
+        Failed lines still render an image, so the replies alone would look clean.
+        """
+        translate_lines = app.translate_lines
+
+        async def counting_translate_lines(lines):
+            translations = await translate_lines(lines)
+            if self.step is not None:
+                self.step.translation_failures += translations.count("Translation failed")
+            return translations
+
+        app.translate_lines = counting_translate_lines
+
+    def on_reply(self, original, reply, content, view):
+        entry = self.pending.get(original.id)
+        if entry is None:
+            return
+        step, sent_at, remaining = entry
+        now = time.perf_counter()
+
+        if content and (content.startswith('⏳') or content.startswith('🐢')):
+            step.rejected += 1
+            del self.pending[original.id]
+            return
+        if original.id not in self.first_replied:
+            self.first_replied.add(original.id)
+            step.first_latencies.append(now - sent_at)
+        if content and app.PROGRESS_NOTE in content:
+            return  # pinyin placeholder - the image edit comes later
+        if content and content.startswith('Sorry'):
+            step.errors += 1
+
+        if view is not None and self.random.random() < args.click_ratio:
+            text_key = view.children[0].text_key
+            interaction = FakeInteraction(self, reply, original.author)
+            self.clicks[interaction] = step
+            self.spawn(app.AudioButtonView.play_audio(interaction, text_key))
+
+        remaining -= 1
+        if remaining > 0 and not (content and content.startswith('Sorry, there was an error')):
+            self.pending[original.id] = (step, sent_at, remaining)
+            return
+
+        del self.pending[original.id]
+        step.completed += 1
+        step.latencies.append(now - sent_at)
+        step.last_completion = max(step.last_completion, now)
+
+    def on_audio_sent(self, interaction, ok):
+        step = self.clicks.pop(interaction, None)
+        if step is None:
+            return
+        if ok:
+            step.audio_latencies.append(time.perf_counter() - interaction.created)
+        else:
+            step.audio_errors += 1
+
+    async def monitor_loop(self, interval=0.01):
+        """Sample event-loop lag as the overshoot of a short sleep."""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            if self.step is not None:
+                self.step.loop_lag.append(max(0.0, time.perf_counter() - started - interval))
+                self.step.max_queue_depth = max(self.step.max_queue_depth, app.pinyin_queue.depth())
+
+    async def run_step(self, rate):
+        step = self.step = Step(rate)
+        deadline = step.started + args.duration
+        next_send = step.started
+
+        # Poisson arrivals at the offered rate
+        while next_send < deadline:
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+            message, line_count = self.make_message()
+            self.pending[message.id] = (step, time.perf_counter(), line_count)
+            step.sent += 1
+            # discord.py dispatches every event as its own task
+            self.spawn(app.on_message(message))
+            next_send += self.random.expovariate(rate)
+
+        drain_deadline = time.perf_counter() + args.drain_timeout
+        while (self.pending or self.clicks) and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.05)
+
+        timeouts = sum(1 for entry in self.pending.values() if entry[0] is step)
+        audio_timeouts = sum(1 for s in self.clicks.values() if s is step)
+        self.pending.clear()
+        self.clicks.clear()
+        self.first_replied.clear()
+        self.step = None
+        return step.report(timeouts, audio_timeouts)
+
+
+async def setup():
+    app.bot._connection.user = FakeUser(1, bot=True)
+    app.pinyin_queue.start()
+    app.channel_journal.start()
+    await app.load_active_channels()
+
+    harness = LoadHarness()
+    harness.count_translation_failures()
+    for guild in harness.guilds:
+        for channel in harness.channels[guild.id]:
+            app.add_active_channel((guild.id, channel.id))
+    return harness
+
+async def teardown():
+    await app.pinyin_queue.stop()
+    await app.channel_journal.stop()
+    app.shutdown_render_executor()
+
+def print_step(result):
+    def fmt(value):
+        return f'{value:9.0f}' if value is not None else f"{'-':>9}"
+    print(f"{result['offered_per_s']:8.1f} {result['throughput_per_s']:8.1f} {result['sent']:6} {result['completed']:6} "
+          f"{result['rejected'] + result['errors'] + result['translation_failures'] + result['timeouts']:6} "
+          f"{fmt(result['first_reply_p50_ms'])} {fmt(result['latency_p50_ms'])} {fmt(result['latency_p95_ms'])} {fmt(result['latency_p99_ms'])} "
+          f"{fmt(result['audio_p50_ms'])} {fmt(result['loop_lag_p99_ms'])} {fmt(result['loop_lag_max_ms'])} "
+          f"{result['max_queue_depth']:6}", file=sys.stderr)
+
+async def main():
+    install_tts_stub(args.tts_latency)
+    app.anthropic_client = FakeAnthropic(args.anthropic_latency)
+    app.anthropic_semaphore = asyncio.Semaphore(app.ANTHROPIC_MAX_CONCURRENCY)
+    app.db = FakeFirestore(args.firestore_latency)
+
+    harness = await setup()
+    monitor = asyncio.create_task(harness.monitor_loop())
+
+    print(f"{'offered':>8} {'msg/s':>8} {'sent':>6} {'done':>6} {'failed':>6} {'first p50':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'audio p50':>9} {'lag p99':>9} {'lag max':>9} {'queue':>6}", file=sys.stderr)
+    results = []
+    try:
+        for rate in [float(rate) for rate in args.rates.split(',')]:
+            result = await harness.run_step(rate)
+            results.append(result)
+            print_step(result)
+    finally:
+        monitor.cancel()
+        await teardown()
+
+    failures = sum(result['translation_failures'] for result in results)
+    if failures:
+        print(f"⚠️ {failures} lines fell back to 'Translation failed' "
+              f"({app.anthropic_client.timeouts} fake Claude timeouts)", file=sys.stderr)
+    return results
+
+if __name__ == '__main__':
+    # Missing-glyph warnings would otherwise bury the report on machines without the CJK fonts
+    warnings.filterwarnings('ignore', message='Glyph')
+    
+    # The bot logs every job; keep stdout quiet and print the report to stderr
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            results = asyncio.run(main())
+        finally:
+            sys.stdout = sys.__stdout__
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'workers': app.PINYIN_WORKERS,
+        'render_pool': app.RENDER_POOL,
+        'render_backend': app.RENDER_BACKEND,
+        'anthropic': {
+            'calls': app.anthropic_client.calls,
+            'timeouts': app.anthropic_client.timeouts,
+            'peak_in_flight': app.anthropic_client.peak_in_flight,
+            'max_concurrency': app.ANTHROPIC_MAX_CONCURRENCY,
+        },
+        'steps': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Saved results to {args.output}")
+
+    # Fail the run so a broken translation path can't pass as a clean result
+    if any(result['translation_failures'] for result in results):
+        sys.exit(1)
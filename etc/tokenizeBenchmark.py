@@ -0,0 +1,77 @@
+"""Micro-benchmark: tokenize_spans / text_to_pinyin vs. the original per-character tokenizer + segment dicts.
+
+Both sides share the warm segment_to_pinyin cache, so the pinyin column times
+tokenizing and assembling the pinyin line - what create_image runs for every line.
+
+Run from the repository root: python etc/tokenizeBenchmark.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import has_chinese_content, segment_to_pinyin, text_to_pinyin, tokenize_spans
+
+
+def legacy_is_chinese_char(char):
+    return '一' <= char <= '鿿'
+
+def legacy_has_chinese_content(text):
+    return any(legacy_is_chinese_char(char) for char in text)
+
+def legacy_tokenize_text(text):
+    segments = []
+    current_segment = ""
+    is_current_chinese = None
+    
+    for char in text:
+        char_is_chinese = legacy_is_chinese_char(char)
+        
+        if is_current_chinese is None:
+            current_segment = char
+            is_current_chinese = char_is_chinese
+        elif char_is_chinese == is_current_chinese:
+            current_segment += char
+        else:
+            segments.append({'text': current_segment, 'is_chinese': is_current_chinese})
+            current_segment = char
+            is_current_chinese = char_is_chinese
+    
+    if current_segment:
+        segments.append({'text': current_segment, 'is_chinese': is_current_chinese})
+    
+    return segments
+
+def legacy_text_to_pinyin(text):
+    processed = [
+        {'original': seg['text'], 'pinyin': segment_to_pinyin(seg['text']) if seg['is_chinese'] else seg['text'],
+         'is_chinese': seg['is_chinese']}
+        for seg in legacy_tokenize_text(text)
+    ]
+    return ''.join(seg['pinyin'] for seg in processed)
+
+
+SAMPLES = {
+    'short': '你好，世界！',
+    'mixed': '我今天用 Python 写了一个 Discord bot，感觉很 cool。' * 20,
+    'long': '学而时习之，不亦说乎？有朋自远方来，不亦乐乎？人不知而不愠，不亦君子乎？' * 200,
+    'english': 'The quick brown fox jumps over the lazy dog. ' * 100 + '狐狸',
+}
+
+if __name__ == '__main__':
+    for name, text in SAMPLES.items():
+        assert text_to_pinyin(text) == legacy_text_to_pinyin(text), name
+        assert [text[start:end] for start, end, _ in tokenize_spans(text)] == [seg['text'] for seg in legacy_tokenize_text(text)], name
+        number = max(1, 20000 // len(text))
+        
+        old_tokens = timeit.timeit(lambda: legacy_tokenize_text(text), number=number) / number
+        new_tokens = timeit.timeit(lambda: list(tokenize_spans(text)), number=number) / number
+        old = timeit.timeit(lambda: legacy_text_to_pinyin(text), number=number) / number
+        new = timeit.timeit(lambda: text_to_pinyin(text), number=number) / number
+        old_scan = timeit.timeit(lambda: legacy_has_chinese_content(text), number=number) / number
+        new_scan = timeit.timeit(lambda: has_chinese_content(text), number=number) / number
+        
+        print(f"{name:8} {len(text):6} chars | tokenize {old_tokens * 1e6:8.1f}µs -> {new_tokens * 1e6:7.1f}µs "
+              f"| pinyin line {old * 1e6:9.1f}µs -> {new * 1e6:8.1f}µs "
+              f"({old / new:5.1f}x) | detect {old_scan * 1e6:8.1f}µs -> {new_scan * 1e6:6.1f}µs")